@@ -1,3 +1,4 @@
+import bisect
 import logging
 import random
 import asyncio
@@ -20,6 +21,10 @@ from tabulate import tabulate
 
 logger = logging.getLogger("red.RedX.AltEco")
 
+LEADERBOARD_MAX_TOP = 50
+
+ROLLUP_HOURLY_LIFETIME = 604800 # Les totaux horaires sont supprimés après 7 jours (la variation est calculée sur 72h au plus)
+
 
 class AltEcoAccount:
     def __init__(self, member: discord.Member, balance: int, logs: list, config: dict):
@@ -77,6 +82,8 @@ class AltEco(commands.Cog):
 
         default_member = {'balance': 0,
                           'logs': [],
+                          'rollups': {'hourly': {},
+                                      'init': False},
                           'config': {
                               'logs_expiration': 86400,
                               'variation_period': 86400,
@@ -96,29 +103,39 @@ class AltEco(commands.Cog):
         self.config.register_member(**default_member)
         self.config.register_guild(**default_guild)
         
+        self.leaderboards = {}
+        
     
-    async def migrate_from_finance(self):
-        """Tente l'importation des données depuis l'ancien module économique Finance"""
+    async def migrate_from_finance(self, *, dry_run: bool = False, progress = None) -> dict:
+        """Importe les soldes et paramètres de l'ancien module économique Finance sur tous les serveurs du bot
+        
+        L'importation passe par le pipeline de migration de XPay (*XPay.migration_pipeline*), qui doit donc être chargé :
+        seuls les comptes modifiés sont écrits, par lots. Avec *dry_run*, rien n'est écrit.
+        *progress* est une coroutine appelée avec (serveur, comptes écrits, total) après chaque lot.
+        
+        Renvoie pour chaque ID de serveur le nombre de comptes Finance, de comptes modifiés et la différence totale de crédits
+        (un dict vide signifie qu'aucun serveur n'a été traité). Les erreurs sont journalisées puis propagées"""
+        xpay = self.bot.get_cog('XPay')
+        if not xpay:
+            raise RuntimeError("Le module XPay doit être chargé pour importer les données de Finance")
+        finance_config = Config.get_conf(None, identifier=736144321857978388, cog_name="Finance")
+        
+        def guild_mapper(old: dict):
+            return {'Currency': {'string': old['currency']},
+                    'DailyBonus': {'base': old['daily_bonus'], 'boost': old['booster_bonus']}}
+        
+        def member_mapper(old: dict):
+            return {'balance': old['balance'],
+                    'config': {'bonus_base': old['config']['daily_bonus'],
+                               'bonus_boost': old['config']['daily_bonus']}}
+        
         try:
-            finance_config = Config.get_conf(None, identifier=736144321857978388, cog_name="Finance")
-            guilds = self.bot.guilds
-            n = 1
-            for guild in guilds:
-                logger.info(msg=f"{n} Importation des données Finance de : {guild.name}")
-                old_data = await finance_config.guild(guild).all()
-                await self.config.guild(guild).Currency.set_raw('string', value=old_data['currency'])
-                await self.config.guild(guild).DailyBonus.set({'base': old_data['daily_bonus'], 'boost': old_data['booster_bonus']})
-
-                for member in guild.members:
-                    user_old = await finance_config.member(member).all()
-                    await self.config.member(member).balance.set(user_old['balance'])
-                    await self.config.member(member).config.set_raw('bonus_base', value=user_old['config']['daily_bonus'])
-                    await self.config.member(member).config.set_raw('bonus_boost', value=user_old['config']['daily_bonus'])
-
-                n += 1
-        except:
-            return False
-        return True
+            return await xpay.migration_pipeline(finance_config, guild_mapper, member_mapper, target=self.config, balance_key='balance',
+                                                 dry_run=dry_run, progress=progress,
+                                                 on_guild=lambda guild: self.leaderboards.pop(guild.id, None))
+        except Exception as e:
+            logger.error(e, exc_info=True)
+            raise
         
 
 # Banque et serveur ---------------------
@@ -140,20 +157,47 @@ class AltEco(commands.Cog):
                 top.append(AltEcoAccount(user, **acc))
         return top[:top_cutoff] if top_cutoff else top
     
+    async def get_ranking(self, guild: discord.Guild) -> dict:
+        """Renvoie le classement en cache du serveur, construit lors du premier appel puis mis à jour à chaque modification de solde
+        
+        Contient le classement trié des membres présents, leurs soldes et le total des crédits"""
+        if guild.id not in self.leaderboards:
+            users = await self.config.all_members(guild)
+            balances = {uid: users[uid]['balance'] for uid in users if guild.get_member(uid)}
+            self.leaderboards[guild.id] = {
+                'ranking': sorted((-b, uid) for uid, b in balances.items()),
+                'balances': balances,
+                'total': sum([users[u]['balance'] for u in users])
+            }
+        return self.leaderboards[guild.id]
+    
+    def update_ranking(self, member: discord.Member, old: int, new: int):
+        """Répercute une modification de solde sur le classement en cache"""
+        cache = self.leaderboards.get(member.guild.id)
+        if not cache:
+            return
+        cache['total'] += new - old
+        ranking = cache['ranking']
+        if member.id in cache['balances']:
+            key = (-cache['balances'][member.id], member.id)
+            i = bisect.bisect_left(ranking, key)
+            if i < len(ranking) and ranking[i] == key:
+                del ranking[i]
+        cache['balances'][member.id] = new
+        bisect.insort(ranking, (-new, member.id))
+    
     async def get_leaderboard_member_rank(self, member: discord.Member) -> int:
         """Renvoie la position du membre dans le classement de son serveur
 
         Renvoie la dernière place du classement si le membre n'est pas trouvé"""
-        top = await self.get_leaderboard(member.guild)
-        for acc in top:
-            if acc.member == member:
-                return top.index(acc) + 1
-        return len(top)
+        cache = await self.get_ranking(member.guild)
+        if member.id not in cache['balances']:
+            return len(cache['ranking'])
+        return bisect.bisect_left(cache['ranking'], (-cache['balances'][member.id], member.id)) + 1
 
     async def guild_total_credits(self, guild: discord.Guild) -> int:
         """Renvoie la valeur totale des crédits en circulation sur le serveur visé"""
-        users = await self.config.all_members(guild)
-        return sum([users[u]['balance'] for u in users])
+        return (await self.get_ranking(guild))['total']
 
     
 # Compte personnel ----------------------
@@ -178,6 +222,7 @@ class AltEco(commands.Cog):
         
         current = await self.get_balance(member)
         await self.config.member(member).balance.set(value)
+        self.update_ranking(member, current, value)
         
         await self.attach_log(member, value - current, **info)
         
@@ -199,17 +244,25 @@ class AltEco(commands.Cog):
         return await self.set_balance(member, current - value, **info)
     
     async def get_balance_variation(self, member: discord.Member, period: int = None) -> int:
-        """Calculer la variation du solde sur une période"""
+        """Calculer la variation du solde sur une période
+        
+        Utilise les totaux horaires des opérations. La première heure (partielle) de la période est lue dans les logs lorsqu'ils couvrent
+        toute la période, sinon son total horaire est compté au prorata de la part de l'heure incluse dans la période"""
+        data = await self.config.member(member).all()
         if not period:
-            period = await self.config.member(member).config.get_raw('variation_period')
-        
-        diff = time.time() - period
-        logs = await self.config.member(member).logs()
-        delta = 0
-        for l in logs:
-            if l['timestamp'] >= diff: 
-                delta += l['delta']
-                
+            period = data['config']['variation_period']
+        
+        start = time.time() - period
+        if not data['rollups']['init']:
+            return sum([l['delta'] for l in data['logs'] if l['timestamp'] >= start])
+        
+        first_hour = int(start // 3600)
+        hourly = data['rollups']['hourly']
+        delta = sum([v for h, v in hourly.items() if int(h) > first_hour])
+        if data['config']['logs_expiration'] >= period:
+            delta += sum([l['delta'] for l in data['logs'] if start <= l['timestamp'] < (first_hour + 1) * 3600])
+        else:
+            delta += round(hourly.get(str(first_hour), 0) * ((first_hour + 1) * 3600 - start) / 3600)
         return delta
         
         
@@ -217,44 +270,62 @@ class AltEco(commands.Cog):
     
     async def get_logs(self, member: discord.Member) -> List[AltEcoOperation]:
         """Renvoie les logs formattés d'un membre"""
-        raw = await self.clear_logs(member)
-        logs = []
-        for l in raw:
-            logs.append(AltEcoOperation(member, **l))
-        return logs
+        data = await self.config.member(member).all()
+        limit = time.time() - data['config']['logs_expiration']
+        return [AltEcoOperation(member, **l) for l in data['logs'] if l['timestamp'] > limit]
+    
+    def compact_logs(self, logs: list, rollups: dict, exp: int):
+        """Compacte sur place les logs et totaux horaires d'un compte : retire les logs expirés et les totaux de plus de 7 jours
+        
+        Les totaux horaires contenant déjà toutes les opérations, les logs retirés restent pris en compte dans les variations"""
+        if not rollups['init']:
+            for l in logs:
+                hour = str(int(l['timestamp'] // 3600))
+                rollups['hourly'][hour] = rollups['hourly'].get(hour, 0) + l['delta']
+            rollups['init'] = True
+        rollups.pop('daily', None) # Anciens totaux journaliers, inutilisés
+        
+        now = time.time()
+        logs[:] = [l for l in logs if l['timestamp'] + exp > now]
+        for hour in [h for h in rollups['hourly'] if (int(h) + 1) * 3600 + ROLLUP_HOURLY_LIFETIME <= now]:
+            del rollups['hourly'][hour]
 
     async def attach_log(self, member: discord.Member, delta: int, **info) -> AltEcoOperation:
         """Ajouter un log d'une opération"""
         log = {'delta': delta, 'timestamp': time.time()}
         log.update(info)
         
-        async with self.config.member(member).logs() as logs:
+        account = self.config.member(member)
+        exp = await account.config.get_raw('logs_expiration')
+        async with account.logs() as logs, account.rollups() as rollups:
+            self.compact_logs(logs, rollups, exp)
             logs.append(log)
-        await self.clear_logs(member)
+            hour = str(int(log['timestamp'] // 3600))
+            rollups['hourly'][hour] = rollups['hourly'].get(hour, 0) + delta
         
         return AltEcoOperation(member, **log)
     
     async def remove_log(self, member: discord.Member, uid: str) -> None:
-        """Retire un log à partir de son UID"""
-        logs = await self.clear_logs(member)
-        async with self.config.member(member).logs() as raw_logs:
-            for l in logs:
-                if f"{l['timestamp']}{l['delta']:+}" == uid:
-                    raw_logs.remove(l)
+        """Retire un log à partir de son UID
+        
+        L'UID est celui de *AltEcoOperation.uid* (timestamp entier), l'ancien format fondé sur le timestamp complet reste accepté"""
+        account = self.config.member(member)
+        exp = await account.config.get_raw('logs_expiration')
+        async with account.logs() as logs, account.rollups() as rollups:
+            self.compact_logs(logs, rollups, exp)
+            for l in [l for l in logs if uid in (f"{int(l['timestamp'])}{l['delta']:+}", f"{l['timestamp']}{l['delta']:+}")]:
+                logs.remove(l)
+                hour = str(int(l['timestamp'] // 3600))
+                if hour in rollups['hourly']:
+                    rollups['hourly'][hour] -= l['delta']
     
     async def clear_logs(self, member: discord.Member, exp: int = None) -> list:
-        """Supprime les logs du membre ayant expiré"""
-        if not exp:
-            exp = await self.config.member(member).config.get_raw('logs_expiration')
-        
-        current_logs = await self.config.member(member).logs()
-        new_logs = copy(current_logs)
-        for l in current_logs:
-            if l['timestamp'] + exp <= time.time():
-                new_logs.remove(l)
-        
-        await self.config.member(member).logs.set(new_logs)
-        return new_logs
+        """Supprime les logs du membre ayant expiré (leurs totaux sont conservés dans les rollups)"""
+        account = self.config.member(member)
+        exp = exp if exp else await account.config.get_raw('logs_expiration')
+        async with account.logs() as logs, account.rollups() as rollups:
+            self.compact_logs(logs, rollups, exp)
+        return logs
     
     
 # Codes ---------------------------------------
@@ -299,18 +370,22 @@ class AltEco(commands.Cog):
     async def wipe_logs(self, member: discord.Member) -> None:
         """Supprime tous les logs d'un membre"""
         await self.config.member(member).clear_raw('logs')
+        await self.config.member(member).clear_raw('rollups')
 
     async def wipe_guild(self, guild: discord.Guild) -> None:
         """Supprime les données bancaires des membres d'un serveur"""
         await self.config.clear_all_members(guild)
+        self.leaderboards.pop(guild.id, None)
 
     async def wipe_account(self, member: discord.Member) -> None:
         """Supprime les données bancaires d'un membre"""
         await self.config.member(member).clear()
+        self.leaderboards.pop(member.guild.id, None)
 
     async def delete_account_id(self, user_id: int, guild: discord.Guild) -> None:
         """Supprime un compte bancaire par ID du membre"""
         await self.config.member_from_ids(guild.id, user_id).clear()
+        self.leaderboards.pop(guild.id, None)
 
     async def red_delete_data_for_user(
         self, *, requester: Literal["discord", "owner", "user", "user_strict"], user_id: int
@@ -320,6 +395,16 @@ class AltEco(commands.Cog):
         async for guild_id, guild_data in AsyncIter(all_members.items(), steps=100):
             if user_id in guild_data:
                 await self.config.member_from_ids(guild_id, user_id).clear()
+                self.leaderboards.pop(guild_id, None)
+                
+                
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        self.leaderboards.pop(member.guild.id, None)
+        
+    @commands.Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        self.leaderboards.pop(member.guild.id, None)
                 
                 
     # Utiles --------------------------------------
@@ -495,38 +580,41 @@ class AltEco(commands.Cog):
     async def display_leaderboard(self, ctx, top: int = 20):
         """Affiche le top des membres les plus riches du serveur
 
-        Vous pouvez modifier la longueur du top en précisant le paramètre `top`"""
-        lbd = await self.get_leaderboard(ctx.guild, top)
+        Vous pouvez modifier la longueur du top en précisant le paramètre `top` (entre 1 et 50)"""
+        cache = await self.get_ranking(ctx.guild)
+        if not cache['ranking']:
+            return await ctx.send("Il n'y a aucun top à afficher car aucun membre ne possède de crédits.")
+        
+        top = max(1, min(top, LEADERBOARD_MAX_TOP))
         n_medals = {
             1: '🥇',
             2: '🥈',
             3: '🥉'
         }
-        if lbd:
-            tbl = []
-            found = False
-            mn = 1
-            for acc in lbd:
-                rankn = str(mn) if mn not in n_medals else f'{mn} {n_medals[mn]}'
-                tbl.append([rankn, str(acc.member.display_name), acc.balance])
-                if acc.member == ctx.author:
-                    found = True
-                mn += 1
-            em = discord.Embed(color=await self.bot.get_embed_color(ctx.channel),
-                               description=box(tabulate(tbl, headers=["Rang", "Membre", "Solde"])))
-            if not found:
-                em.add_field(name="Votre rang",
-                             value=box("#" + str(await self.get_leaderboard_member_rank(ctx.author)) +
-                                       f" ({int(await self.get_account(ctx.author))})"))
-            em.set_author(name=f"Top des plus riches de {ctx.guild.name}", icon_url=ctx.guild.icon_url)
-            em.set_footer(text=f"Crédits en circulation : {await self.guild_total_credits(ctx.guild)}{await self.get_currency(ctx.guild)}")
-            try:
-                await ctx.send(embed=em)
-            except HTTPException:
-                await ctx.send("**Erreur** • Le top est trop grand pour être affiché, utilisez une "
-                               "valeur de `top` plus réduite")
-        else:
-            await ctx.send("Il n'y a aucun top à afficher car aucun membre ne possède de crédits.")
+        tbl = []
+        members = []
+        mn = 1
+        for b, uid in cache['ranking'][:top]:
+            rankn = str(mn) if mn not in n_medals else f'{mn} {n_medals[mn]}'
+            # Les noms sont lus à l'affichage, un membre ayant quitté le serveur est affiché par son ID
+            user = ctx.guild.get_member(uid)
+            tbl.append([rankn, user.display_name if user else str(uid), -b])
+            members.append(uid)
+            mn += 1
+        table = box(tabulate(tbl, headers=["Rang", "Membre", "Solde"]))
+        
+        em = discord.Embed(color=await self.bot.get_embed_color(ctx.channel), description=table)
+        if ctx.author.id not in members:
+            em.add_field(name="Votre rang",
+                         value=box("#" + str(await self.get_leaderboard_member_rank(ctx.author)) +
+                                   f" ({await self.get_balance(ctx.author)})"))
+        em.set_author(name=f"Top des plus riches de {ctx.guild.name}", icon_url=ctx.guild.icon_url)
+        em.set_footer(text=f"Crédits en circulation : {cache['total']}{await self.get_currency(ctx.guild)}")
+        try:
+            await ctx.send(embed=em)
+        except HTTPException:
+            await ctx.send("**Erreur** • Le top est trop grand pour être affiché, utilisez une "
+                           "valeur de `top` plus réduite")
             
             
     @commands.command(name="redeem")
@@ -663,7 +751,7 @@ class AltEco(commands.Cog):
     async def set_variation_period(self, ctx, hours: int = 24):
         """Modifie le temps (en heures) sur lequel est calculé la variation de votre solde
         
-        Ceci se base sur les logs, si la valeur est supérieure à l'expiration de ceux-ci les résultats seront systématiquement incomplets
+        La variation est calculée à partir des totaux horaires des opérations, conservés 7 jours : elle reste complète même au-delà de l'expiration des logs
         Par défaut 24h"""
         if hours < 1:
             return await ctx.send("**Invalide** • La variation ne peut être calculée au minimum sur une période d'une heure")
@@ -720,11 +808,38 @@ class AltEco(commands.Cog):
             await ctx.send(
                 "**Impossible** • La valeur du bonus doit être positif, ou nulle si vous voulez désactiver la fonctionnalité")
         
+    @eco_settings.command(name="migrate")
+    @checks.is_owner()
+    async def _bank_migrate(self, ctx, apply: bool = False):
+        """Importer les soldes et paramètres de l'ancien module Finance sur tous les serveurs
+        
+        Sans préciser `apply`, affiche seulement les modifications qu'entraînerait l'importation"""
+        msg = await ctx.send("**Importation** • Lecture des données Finance...")
+        
+        async def progress(guild: discord.Guild, done: int, total: int):
+            await msg.edit(content=f"**Importation** • {guild.name} · {done}/{total} comptes écrits")
+        
+        try:
+            report = await self.migrate_from_finance(dry_run=not apply, progress=progress)
+        except Exception as e:
+            return await msg.edit(content=f"**Erreur** • L'importation a échoué : `{e}`")
+        
+        tabl = []
+        for guild_id, r in report.items():
+            if r['accounts']:
+                guild = self.bot.get_guild(guild_id)
+                tabl.append((guild.name[:20] if guild else guild_id, r['accounts'], r['changed'], f"{r['delta']:+}"))
+        if not tabl:
+            return await msg.edit(content="**Aucune donnée** • Aucun compte Finance n'a été trouvé sur les serveurs du bot")
+        
+        title = "**Importation terminée**" if apply else "**Simulation** • Aucune donnée n'a été modifiée, utilisez `bankset migrate true` pour appliquer"
+        await msg.edit(content=title + "\n" + box(tabulate(tabl, headers=["Serveur", "Comptes", "Modifiés", "Δ Crédits"])))
+        
     @eco_settings.command(name="resetuser")
     @checks.admin_or_permissions(manage_messages=True)
     async def _bank_reset_account(self, ctx, user: discord.Member):
         """Reset les données bancaires d'un membre (cache compris)"""
-        await self.config.member(user).clear()
+        await self.wipe_account(user)
         await ctx.send(f"**Succès** • Le compte de {user.mention} a été réinitialisé")
 
     @eco_settings.command(name="resetcache")
@@ -1,6 +1,8 @@
 import asyncio
+import functools
 import logging
 import random
+from typing import Callable, List, Tuple
 
 import discord
 
@@ -9,8 +11,66 @@ from redbot.core.utils.chat_formatting import box
 from redbot.core.utils.menus import start_adding_reactions
 from tabulate import tabulate
 
+from .engine import (DICES_CHOICES, DICES_MAX_BET, DICES_MIN_BET, SLOT_TIERS,
+                     dices_result, get_slot_tier, np, roll_dices)
+
 logger = logging.getLogger("red.RedX.AltGames")
 
+ANIMATION_EDIT_INTERVAL = 1.0
+ANIMATION_FRAME_DELAY = 0.75
+
+
+class ChannelAnimator:
+    """File d'animation partagée par tous les jeux d'un même salon
+
+    Les modifications de messages sont espacées d'au moins ANIMATION_EDIT_INTERVAL secondes pour rester sous la limite
+    de débit de Discord, et lorsque plusieurs images d'un même message sont dues en même temps seule la dernière est envoyée"""
+
+    def __init__(self, channel: discord.TextChannel, on_idle: Callable[['ChannelAnimator'], None] = None):
+        self.channel = channel
+        self.on_idle = on_idle
+        self.frames = {}
+        self.last_edit = 0
+        self.task = None
+
+    def push(self, message: discord.Message, frames: List[Tuple[float, discord.Embed]]):
+        """Programme les images (délai depuis l'image précédente, embed) d'un message
+
+        Les images de ce message qui n'ont pas encore été affichées sont remplacées"""
+        due = asyncio.get_event_loop().time()
+        scheduled = []
+        for delay, embed in frames:
+            due += delay
+            scheduled.append((due, embed))
+        self.frames[message.id] = (message, scheduled)
+        if not self.task or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while self.frames:
+            msg_id = min(self.frames, key=lambda m: self.frames[m][1][0][0])
+            wait = max(self.frames[msg_id][1][0][0], self.last_edit + ANIMATION_EDIT_INTERVAL) - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            
+            message, frames = self.frames[msg_id]
+            now = loop.time()
+            ready = [f for f in frames if f[0] <= now]
+            del frames[:len(ready)]
+            if not frames:
+                del self.frames[msg_id]
+            try:
+                await message.edit(embed=ready[-1][1])
+            except discord.HTTPException as e:
+                logger.info(f"Animation interrompue dans #{self.channel} : {e}")
+                self.frames.pop(msg_id, None)
+            self.last_edit = loop.time()
+        if self.on_idle:
+            self.on_idle(self)
+
+
 class AltGames(commands.Cog):
     """Mini-jeux d'origine de l'économie virtuelle XPay"""
 
@@ -26,6 +86,25 @@ class AltGames(commands.Cog):
         self.config.register_member(**default_member)
         self.config.register_guild(**default_guild)
         
+        self.animators = {}
+        
+    def cog_unload(self):
+        for animator in list(self.animators.values()):
+            if animator.task:
+                animator.task.cancel()
+                
+    def animate(self, message: discord.Message, frames: List[Tuple[float, discord.Embed]]):
+        """Confie les images suivantes d'un message à la file d'animation de son salon"""
+        channel = message.channel
+        if channel.id not in self.animators:
+            self.animators[channel.id] = ChannelAnimator(channel, on_idle=self.forget_animator)
+        self.animators[channel.id].push(message, frames)
+        
+    def forget_animator(self, animator: ChannelAnimator):
+        """Retire la file d'animation d'un salon une fois toutes ses images affichées"""
+        if self.animators.get(animator.channel.id) is animator:
+            del self.animators[animator.channel.id]
+        
     @commands.command()
     @commands.guild_only()
     @commands.cooldown(1, 5, commands.BucketType.member)
@@ -40,247 +119,58 @@ class AltGames(commands.Cog):
         curr = await eco.get_currency(ctx.guild)
 
         if not mise:
-            tbl = [[("🍒", "x2", "Mise + 50"),
-                   ("🍒", "x3", "Mise x3"),
-                   ("🍀", "x2", "Mise + 200"),
-                   ("🍀", "x3", "Mise x5"),
-                   ("💎", "x2", "Mise x10"),
-                   ("💎", "x3", "Mise x20"),
-                   ("⚡", "<3", "Mise perdue"),
-                   ("⚡", "x3", "Mise x30")],
-                   
-                   [("🍒", "x3", "Mise + 250"),
-                   ("🍒", "x4", "Mise x5"),
-                   ("🍀", "x3", "Mise + 1000"),
-                   ("🍀", "x4", "Mise x10"),
-                   ("💎", "x3", "Mise x15"),
-                   ("💎", "x4", "Mise x30"),
-                   ("⚡", "<4", "Mise perdue"),
-                   ("⚡", "x4", "Mise x60")],
-                   
-                   [("🍒", "x3", "Mise + 500"),
-                   ("🍒", "x4", "Mise x5"),
-                   ("🍒", "x5", "Mise x10"),
-                   ("🍀", "x3", "Mise + 5000"),
-                   ("🍀", "x4", "Mise x10"),
-                   ("🍀", "x5", "Mise x20"),
-                   ("💎", "x4", "Mise x25"),
-                   ("💎", "x5", "Mise x50"),
-                   ("⚡", "<5", "Mise perdue"),
-                   ("⚡", "x5", "Mise x100")]]
             em = discord.Embed(title="Tableau des gains",
                                color=await ctx.embed_color(), inline=False)
-            em.add_field(name="Niveau 1 (5 - 100 crédits)", value=box(tabulate(tbl[0], headers=("Emoji", "Nb.", "Gain"))), inline=False)
-            em.add_field(name="Niveau 2 (101 - 500 crédits)", value=box(tabulate(tbl[1])), inline=False)
-            em.add_field(name="Niveau 3 (501 - 1000 crédits)", value=box(tabulate(tbl[2])), inline=False)
+            for n, tier in enumerate(SLOT_TIERS):
+                em.add_field(name=f"Niveau {n + 1} ({tier.min_bet} - {tier.max_bet} crédits)",
+                             value=box(tabulate(tier.table(), headers=("Emoji", "Nb.", "Gain") if not n else ())), inline=False)
             em.set_footer(text=f"🍒 = Même fruit")
             return await ctx.send(embed=em)
         
+        tier = get_slot_tier(mise)
+        if not tier:
+            return await ctx.send(f"**Mise invalide** • Elle doit être comprise entre 5 et 1000{curr} (en fonction du niveau désiré)")
+        
         if not await eco.check_balance(author, mise):
             return await ctx.reply("**Solde insuffisant** • Vous n'avez pas cette somme sur votre compte")
         
-        if 5 <= mise <= 100:
-            async with ctx.channel.typing():
-                delta = 0
-
-                col = ["🍎", "🍊", "🍋", "🍒", "🍉", "⚡", "💎", "🍀"]
-                fruits = ["🍎", "🍊", "🍋", "🍒", "🍉"]
-                col = col[-3:] + col + col[:3]
-                cols = []
-                mid = []
-                for i in range(3):
-                    n = random.randint(3, 10)
-                    cols.append((col[n-1], col[n], col[n+1]))
-                    mid.append(col[n])
-
-                aff = "{a[0]}|{b[0]}|{c[0]}\n" \
-                        "{a[1]}|{b[1]}|{c[1]} <= \n" \
-                        "{a[2]}|{b[2]}|{c[2]}".format(a=cols[0], b=cols[1], c=cols[2])
-
-                count = lambda e: mid.count(e)
-
-                def fruitcount():
-                    for f in fruits:
-                        if count(f) >= 2:
-                            return count(f)
-                    return 0
-
-                if count("⚡") == 3:
-                    delta = mise * 30
-                    txt = "3x ⚡ · Vous gagnez {}"
-                elif count("⚡") in (1, 2):
-                    txt = "Zap ⚡ · Vous perdez votre mise"
-                elif count("💎") == 3:
-                    delta = mise * 20
-                    txt = "3x 💎 · Vous gagnez {}"
-                elif count("💎") == 2:
-                    delta = mise * 10
-                    txt = "2x 💎 · Vous gagnez {}"
-                elif count("🍀") == 3:
-                    delta = mise * 5
-                    txt = "3x 🍀 · Vous gagnez {}"
-                elif count("🍀") == 2:
-                    delta = mise + 200
-                    txt = "2x 🍀 · Vous gagnez {}"
-                elif fruitcount() == 3:
-                    delta = mise * 3
-                    txt = "3x fruit · Vous gagnez {}"
-                elif fruitcount() == 2:
-                    delta = mise + 50
-                    txt = "2x fruit · Vous gagnez {}"
-                else:
-                    txt = "Rien · Vous perdez votre mise"
-
-                await asyncio.sleep(1)
-
-                ope = delta - mise
-                if ope > 0:
-                    await eco.deposit_credits(author, ope, reason="Gain à la Machine à sous")
-                elif ope < 0:
-                    await eco.withdraw_credits(author, mise, reason="Perte à la Machine à sous")
-
-            em = discord.Embed(description=f"**Mise :** {mise}{curr}\n" + box(aff), color=author.color)
-            em.set_author(name="🎰 N1 · " + str(author), icon_url=author.avatar_url)
-            em.set_footer(text=txt.format(f"{delta} {curr}"))
-            await ctx.send(embed=em)
-            
-        elif 101 <= mise <= 500:
-            async with ctx.channel.typing():
-                delta = 0
-
-                col = ["🍎", "🍊", "🍋", "🍒", "🍉", "⚡", "💎", "🍀"]
-                fruits = ["🍎", "🍊", "🍋", "🍒", "🍉"]
-                col = col[-3:] + col + col[:3]
-                cols = []
-                mid = []
-                for i in range(4):
-                    n = random.randint(3, 10)
-                    cols.append((col[n-1], col[n], col[n+1]))
-                    mid.append(col[n])
-
-                aff = "{a[0]}|{b[0]}|{c[0]}|{d[0]}\n" \
-                        "{a[1]}|{b[1]}|{c[1]}|{d[1]} <= \n" \
-                        "{a[2]}|{b[2]}|{c[2]}|{d[2]}".format(a=cols[0], b=cols[1], c=cols[2], d=cols[3])
-
-                count = lambda e: mid.count(e)
-
-                def fruitcount():
-                    for f in fruits:
-                        if count(f) >= 2:
-                            return count(f)
-                    return 0
-
-                if count("⚡") == 4:
-                    delta = mise * 60
-                    txt = "4x ⚡ · Vous gagnez {}"
-                elif count("⚡") in (1, 2, 3):
-                    txt = "Zap ⚡ · Vous perdez votre mise"
-                elif count("💎") == 4:
-                    delta = mise * 30
-                    txt = "4x 💎 · Vous gagnez {}"
-                elif count("💎") == 3:
-                    delta = mise * 15
-                    txt = "3x 💎 · Vous gagnez {}"
-                elif count("🍀") == 4:
-                    delta = mise * 10
-                    txt = "4x 🍀 · Vous gagnez {}"
-                elif count("🍀") == 3:
-                    delta = mise + 1000
-                    txt = "3x 🍀 · Vous gagnez {}"
-                elif fruitcount() == 4:
-                    delta = mise * 5
-                    txt = "4x fruit · Vous gagnez {}"
-                elif fruitcount() == 3:
-                    delta = mise + 250
-                    txt = "3x fruit · Vous gagnez {}"
-                else:
-                    txt = "Rien · Vous perdez votre mise"
-
-                await asyncio.sleep(1)
-
-                ope = delta - mise
-                if ope > 0:
-                    await eco.deposit_credits(author, ope, reason="Gain à la Machine à sous")
-                elif ope < 0:
-                    await eco.withdraw_credits(author, mise, reason="Perte à la Machine à sous")
-
+        cols, outcome = tier.spin()
+        delta = tier.payout(outcome, mise)
+        ope = delta - mise
+        if ope > 0:
+            await eco.deposit_credits(author, ope, reason="Gain à la Machine à sous")
+        elif ope < 0:
+            await eco.withdraw_credits(author, mise, reason="Perte à la Machine à sous")
+
+        def affem(shown: int, footer: str):
+            reels = [c if i < shown else ("⬛", "❔", "⬛") for i, c in enumerate(cols)]
+            aff = "\n".join("|".join(c[row] for c in reels) + (" <= " if row == 1 else "") for row in range(3))
             em = discord.Embed(description=f"**Mise :** {mise}{curr}\n" + box(aff), color=author.color)
-            em.set_author(name="🎰 N2 · " + str(author), icon_url=author.avatar_url)
-            em.set_footer(text=txt.format(f"{delta} {curr}"))
-            await ctx.send(embed=em)
-            
-        elif 501 <= mise <= 1000:
-            async with ctx.channel.typing():
-                delta = 0
-
-                col = ["🍎", "🍊", "🍋", "🍒", "🍉", "⚡", "💎", "🍀"]
-                fruits = ["🍎", "🍊", "🍋", "🍒", "🍉"]
-                col = col[-3:] + col + col[:3]
-                cols = []
-                mid = []
-                for i in range(5):
-                    n = random.randint(3, 10)
-                    cols.append((col[n-1], col[n], col[n+1]))
-                    mid.append(col[n])
-
-                aff = "{a[0]}|{b[0]}|{c[0]}|{d[0]}|{e[0]}\n" \
-                        "{a[1]}|{b[1]}|{c[1]}|{d[1]}|{e[1]} <= \n" \
-                        "{a[2]}|{b[2]}|{c[2]}|{d[2]}|{e[2]}".format(a=cols[0], b=cols[1], c=cols[2], d=cols[3], e=cols[4])
-
-                count = lambda e: mid.count(e)
-
-                def fruitcount():
-                    for f in fruits:
-                        if count(f) >= 2:
-                            return count(f)
-                    return 0
-
-                if count("⚡") == 5:
-                    delta = mise * 100
-                    txt = "5x ⚡ · Vous gagnez {}"
-                elif count("⚡") in (1, 2, 3, 4):
-                    txt = "Zap ⚡ · Vous perdez votre mise"
-                elif count("💎") == 5:
-                    delta = mise * 50
-                    txt = "5x 💎 · Vous gagnez {}"
-                elif count("💎") == 4:
-                    delta = mise * 25
-                    txt = "4x 💎 · Vous gagnez {}"
-                elif count("🍀") == 5:
-                    delta = mise * 20
-                    txt = "5x 🍀 · Vous gagnez {}"
-                elif count("🍀") == 4:
-                    delta = mise * 10
-                    txt = "4x 🍀 · Vous gagnez {}"
-                elif count("🍀") == 3:
-                    delta = mise + 5000
-                    txt = "3x 🍀 · Vous gagnez {}"
-                elif fruitcount() == 5:
-                    delta = mise * 10
-                    txt = "5x fruit · Vous gagnez {}"
-                elif fruitcount() == 4:
-                    delta = mise * 5
-                    txt = "4x fruit · Vous gagnez {}"
-                elif fruitcount() == 3:
-                    delta = mise + 500
-                    txt = "3x fruit · Vous gagnez {}"
-                else:
-                    txt = "Rien · Vous perdez votre mise"
-
-                await asyncio.sleep(1)
-
-                ope = delta - mise
-                if ope > 0:
-                    await eco.deposit_credits(author, ope, reason="Gain à la Machine à sous")
-                elif ope < 0:
-                    await eco.withdraw_credits(author, mise, reason="Perte à la Machine à sous")
-
-            em = discord.Embed(description=f"**Mise :** {mise}{curr}\n" + box(aff), color=author.color)
-            em.set_author(name="🎰 N3 · " + str(author), icon_url=author.avatar_url)
-            em.set_footer(text=txt.format(f"{delta} {curr}"))
-            await ctx.send(embed=em)
-        else:
-            await ctx.send(f"**Mise invalide** • Elle doit être comprise entre 5 et 1000{curr} (en fonction du niveau désiré)")
+            em.set_author(name=f"🎰 {tier.name} · " + str(author), icon_url=author.avatar_url)
+            em.set_footer(text=footer)
+            return em
+
+        msg = await ctx.send(embed=affem(0, "La machine tourne..."))
+        frames = [(ANIMATION_FRAME_DELAY, affem(i, "La machine tourne...")) for i in range(1, tier.reels)]
+        frames.append((ANIMATION_FRAME_DELAY, affem(tier.reels, tier.label(outcome).format(f"{delta} {curr}"))))
+        self.animate(msg, frames)
+        
+    @commands.command(name="slotstats")
+    @commands.is_owner()
+    async def slot_stats(self, ctx, spins: int = 1000000):
+        """Calcule le taux de redistribution de chaque niveau de machine à sous et le vérifie par simulation
+        
+        La simulation est bien plus rapide si NumPy est installé"""
+        tbl = []
+        async with ctx.channel.typing():
+            for tier in SLOT_TIERS:
+                for bet in (tier.min_bet, tier.max_bet):
+                    sim = await self.bot.loop.run_in_executor(None, functools.partial(tier.simulate, bet, spins))
+                    tbl.append((tier.name, bet, f"{tier.expected_return(bet):.2%}", f"{sim['rtp']:.2%}"))
+        em = discord.Embed(title="Taux de redistribution · Machine à sous", color=await ctx.embed_color(),
+                           description=box(tabulate(tbl, headers=("Niv.", "Mise", "Théorique", "Simulé"))))
+        em.set_footer(text=f"{spins} tirages simulés par ligne · {'NumPy' if np is not None else 'Python'}")
+        await ctx.send(embed=em)
     
     @commands.command(aliases=["des"])
     @commands.guild_only()
@@ -296,7 +186,7 @@ class AltGames(commands.Cog):
         eco = self.bot.get_cog("XPay")
         curr = await eco.get_currency(ctx.guild)
 
-        if 10 <= mise <= 200:
+        if DICES_MIN_BET <= mise <= DICES_MAX_BET:
             if await eco.check_balance(author, mise):
 
                 def affem(userval, botval, footer):
@@ -307,16 +197,11 @@ class AltGames(commands.Cog):
                     em.set_footer(text=footer)
                     return em
 
-                async with ctx.channel.typing():
-                    user_dices = [random.randint(1, 6), random.randint(1, 6)]
-                    bot_dices = [random.randint(1, 6), random.randint(1, 6)]
-                    await asyncio.sleep(1.5)
-
-                    before = affem(box(f"🎲 {user_dices[0]} "), box(f"🎲 {bot_dices[0]} "),
-                                   "Allez-vous avoir plus ou moins que moi avec le prochain lancé ?")
-
-                msg = await ctx.send(embed=before)
-                emojis = ["➕", "➖"]
+                user_dices, bot_dices = roll_dices()
+                # Le premier dé est affiché dès l'envoi pour que le choix ne puisse pas précéder sa révélation
+                msg = await ctx.send(embed=affem(box(f"🎲 {user_dices[0]} "), box(f"🎲 {bot_dices[0]} "),
+                                                 "Allez-vous avoir plus ou moins que moi avec le prochain lancé ?"))
+                emojis = list(DICES_CHOICES)
 
                 start_adding_reactions(msg, emojis)
                 try:
@@ -328,42 +213,19 @@ class AltGames(commands.Cog):
                 else:
                     emoji = react.emoji
 
-                if sum(user_dices) == sum(bot_dices):
-                    after = affem(box(f"🎲 {user_dices[0]}, {user_dices[1]} "),
-                                  box(f"🎲 {bot_dices[0]}, {bot_dices[1]} "),
-                                  "Egalité ! Vous ne perdez pas votre mise")
-                    return await msg.edit(embed=after)
-
-                if emoji == "➕":
-                    if sum(user_dices) > sum(bot_dices):
-                        mise = round(mise/2)
-                        await eco.deposit_credits(author, mise, reason="Gain aux dés")
-                        after = affem(box(f"🎲 {user_dices[0]}, {user_dices[1]} "),
-                                  box(f"🎲 {bot_dices[0]}, {bot_dices[1]} "),
-                                      f"Gagné ! Vous gagnez {mise} {curr}")
-                        await msg.edit(embed=after)
-                    else:
-                        await eco.withdraw_credits(author, mise, reason="Perte aux dés")
-                        after = affem(box(f"🎲 {user_dices[0]}, {user_dices[1]} "),
-                                  box(f"🎲 {bot_dices[0]}, {bot_dices[1]} "),
-                                      f"Perdu ! Vous avez perdu votre mise")
-                        await msg.edit(embed=after)
+                delta = dices_result(user_dices, bot_dices, emoji, mise)
+                if delta > 0:
+                    await eco.deposit_credits(author, delta, reason="Gain aux dés")
+                    footer = f"Gagné ! Vous gagnez {delta} {curr}"
+                elif delta < 0:
+                    await eco.withdraw_credits(author, mise, reason="Perte aux dés")
+                    footer = "Perdu ! Vous avez perdu votre mise"
                 else:
-                    if sum(user_dices) < sum(bot_dices):
-                        mise = round(mise / 2)
-                        await eco.deposit_credits(author, mise, reason="Gain aux dés")
-                        after = affem(box(f"🎲 {user_dices[0]}, {user_dices[1]} "),
-                                  box(f"🎲 {bot_dices[0]}, {bot_dices[1]} "),
-                                      f"Gagné ! Vous gagnez {mise} {curr}")
-                        await msg.edit(embed=after)
-                    else:
-                        await eco.withdraw_credits(author, mise, reason="Perte aux dés")
-                        after = affem(box(f"🎲 {user_dices[0]}, {user_dices[1]} "),
-                                  box(f"🎲 {bot_dices[0]}, {bot_dices[1]} "),
-                                      f"Perdu ! Vous avez perdu votre mise")
-                        await msg.edit(embed=after)
+                    footer = "Egalité ! Vous ne perdez pas votre mise"
+                after = affem(box(f"🎲 {user_dices[0]}, {user_dices[1]} "),
+                              box(f"🎲 {bot_dices[0]}, {bot_dices[1]} "), footer)
+                self.animate(msg, [(0, after)])
             else:
                 await ctx.send("**Fonds insuffisants** • Vous n'avez pas cette somme sur votre compte")
         else:
-            await ctx.send(f"**Mise invalide** • Elle doit être comprise entre 10 et 200 {curr}")
-
+            await ctx.send(f"**Mise invalide** • Elle doit être comprise entre {DICES_MIN_BET} et {DICES_MAX_BET} {curr}")
@@ -0,0 +1,155 @@
+"""Banc d'essai Monte-Carlo des mini-jeux AltGames
+
+Simule des parties de `slot` et `dices` sans Discord ni XPay, réparties sur plusieurs processus, et rend compte
+du taux de redistribution, de la variance, de l'évolution de la cagnotte des joueurs et du débit de simulation.
+
+Exemples :
+    python altgames/benchmark.py slot --bet 50 --rounds 1000000 --workers 4
+    python altgames/benchmark.py dices --bet 100 --strategy premier --json"""
+import argparse
+import json
+import math
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable
+
+try:
+    from .engine import DICES_CHOICES, DICES_MAX_BET, DICES_MIN_BET, dices_result, get_slot_tier, roll_dices
+except ImportError:
+    from engine import DICES_CHOICES, DICES_MAX_BET, DICES_MIN_BET, dices_result, get_slot_tier, roll_dices
+
+DICES_STRATEGIES = ('hasard', 'premier')
+
+
+def slot_round(bet: int) -> Callable[[random.Random], int]:
+    tier = get_slot_tier(bet)
+    if not tier:
+        raise ValueError(f"Mise invalide pour la machine à sous : {bet}")
+
+    def play(rng: random.Random) -> int:
+        return tier.payout(tier.spin(rng)[1], bet) - bet
+    return play
+
+
+def dices_round(bet: int, strategy: str = 'hasard') -> Callable[[random.Random], int]:
+    if not DICES_MIN_BET <= bet <= DICES_MAX_BET:
+        raise ValueError(f"Mise invalide pour les dés : {bet}")
+
+    def play(rng: random.Random) -> int:
+        user_dices, bot_dices = roll_dices(rng)
+        if strategy == 'premier' and user_dices[0] != bot_dices[0]:
+            choice = DICES_CHOICES[0] if user_dices[0] > bot_dices[0] else DICES_CHOICES[1]
+        else:
+            choice = rng.choice(DICES_CHOICES)
+        return dices_result(user_dices, bot_dices, choice, bet)
+    return play
+
+
+def get_round(game: str, bet: int, strategy: str = 'hasard') -> Callable[[random.Random], int]:
+    if game == 'slot':
+        return slot_round(bet)
+    elif game == 'dices':
+        return dices_round(bet, strategy)
+    raise ValueError(f"Jeu inconnu : {game}")
+
+
+def run_worker(game: str, bet: int, rounds: int, seed: int = None, strategy: str = 'hasard',
+               bankroll: int = 0, points: int = 20) -> dict:
+    """Joue `rounds` parties consécutives pour un joueur et relève sa cagnotte à intervalles réguliers"""
+    play = get_round(game, bet, strategy)
+    rng = random.Random(seed)
+    step = max(1, math.ceil(rounds / points))
+    net = squares = 0
+    curve = []
+    start = time.perf_counter()
+    for n in range(1, rounds + 1):
+        d = play(rng)
+        net += d
+        squares += d * d
+        if n % step == 0:
+            curve.append(bankroll + net)
+    return {'rounds': rounds, 'net': net, 'squares': squares, 'curve': curve,
+            'duration': time.perf_counter() - start}
+
+
+def benchmark(game: str, bet: int, rounds: int, workers: int = 1, seed: int = None, strategy: str = 'hasard',
+              bankroll: int = 0, points: int = 20) -> dict:
+    """Répartit la simulation sur plusieurs processus (un joueur indépendant par processus) et agrège les résultats
+
+    Il n'y a jamais plus de processus que de parties, afin que chaque joueur relève au moins un point de sa cagnotte"""
+    if rounds < 1:
+        raise ValueError(f"Nombre de parties invalide : {rounds}")
+    workers = max(1, min(workers, rounds))
+    share = [rounds // workers + (1 if i < rounds % workers else 0) for i in range(workers)]
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_worker, game, bet, n, None if seed is None else seed + i, strategy, bankroll, points)
+                   for i, n in enumerate(share) if n]
+        results = [f.result() for f in futures]
+    elapsed = time.perf_counter() - start
+
+    total = sum(r['rounds'] for r in results)
+    net = sum(r['net'] for r in results)
+    mean = net / total
+    variance = sum(r['squares'] for r in results) / total - mean ** 2
+    length = min(len(r['curve']) for r in results)
+    drift = [{'mean': sum(r['curve'][i] for r in results) / len(results),
+              'min': min(r['curve'][i] for r in results),
+              'max': max(r['curve'][i] for r in results)} for i in range(length)]
+    return {'game': game,
+            'bet': bet,
+            'strategy': strategy if game == 'dices' else None,
+            'rounds': total,
+            'workers': len(results),
+            'rtp': (bet + mean) / bet,
+            'house_edge': -mean / bet,
+            'variance': variance,
+            'stdev': variance ** 0.5,
+            'drift': drift,
+            'elapsed': elapsed,
+            'throughput': total / elapsed if elapsed else 0}
+
+
+def format_report(report: dict) -> str:
+    lines = [f"Jeu : {report['game']}" + (f" ({report['strategy']})" if report['strategy'] else ""),
+             f"Mise : {report['bet']} · Parties : {report['rounds']} sur {report['workers']} processus",
+             f"Taux de redistribution : {report['rtp']:.4%} (avantage maison {report['house_edge']:.4%})",
+             f"Variance par partie : {report['variance']:.2f} (écart-type {report['stdev']:.2f})",
+             f"Débit : {report['throughput']:.0f} parties/s ({report['elapsed']:.2f}s)",
+             "",
+             "Évolution de la cagnotte (moyenne / min / max par joueur) :"]
+    for n, p in enumerate(report['drift'], start=1):
+        lines.append(f"  {n:>3}  {p['mean']:>14.1f}  {p['min']:>12}  {p['max']:>12}")
+    return "\n".join(lines)
+
+
+def positive_int(value: str) -> int:
+    n = int(value)
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"doit être un entier supérieur ou égal à 1 : {value}")
+    return n
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Banc d'essai Monte-Carlo des mini-jeux AltGames")
+    parser.add_argument('game', choices=('slot', 'dices'))
+    parser.add_argument('--bet', type=int, default=None, help="Mise par partie (par défaut la mise minimale du jeu)")
+    parser.add_argument('--rounds', type=positive_int, default=1000000, help="Nombre total de parties simulées")
+    parser.add_argument('--workers', type=positive_int, default=4, help="Nombre de processus (un joueur par processus)")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--strategy', choices=DICES_STRATEGIES, default='hasard',
+                        help="Choix aux dés : au hasard ou d'après le premier dé")
+    parser.add_argument('--bankroll', type=int, default=0, help="Cagnotte de départ de chaque joueur")
+    parser.add_argument('--points', type=positive_int, default=20, help="Nombre de relevés de la cagnotte")
+    parser.add_argument('--json', action='store_true', help="Affiche le rapport au format JSON")
+    args = parser.parse_args(argv)
+
+    bet = args.bet or (5 if args.game == 'slot' else DICES_MIN_BET)
+    report = benchmark(args.game, bet, args.rounds, args.workers, args.seed, args.strategy,
+                       args.bankroll, args.points)
+    print(json.dumps(report, indent=4) if args.json else format_report(report))
+
+
+if __name__ == '__main__':
+    main()
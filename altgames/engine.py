@@ -0,0 +1,206 @@
+"""Moteur de tirage des mini-jeux AltGames
+
+Ce module ne dépend ni de Discord ni de XPay afin de pouvoir calculer et simuler les gains hors ligne"""
+import random
+from itertools import product
+from typing import List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SLOT_SYMBOLS = ("🍎", "🍊", "🍋", "🍒", "🍉", "⚡", "💎", "🍀")
+SLOT_FRUITS = SLOT_SYMBOLS[:5]
+SIMULATION_CHUNK_SIZE = 1000000
+DICES_MIN_BET = 10
+DICES_MAX_BET = 200
+DICES_CHOICES = ("➕", "➖")
+
+
+class SlotTier:
+    """Niveau de machine à sous défini par son nombre de rouleaux et sa table des gains
+
+    Chaque règle de la table est un tuple `(symbole, nombres, multiplicateur, bonus)` : la première règle dont le symbole
+    apparaît un nombre de fois contenu dans `nombres` sur la ligne centrale s'applique et rapporte `mise * multiplicateur + bonus`.
+    Le symbole `fruit` désigne n'importe quel fruit répété au moins deux fois."""
+
+    def __init__(self, name: str, reels: int, min_bet: int, max_bet: int, paytable: List[tuple]):
+        self.name = name
+        self.reels = reels
+        self.min_bet = min_bet
+        self.max_bet = max_bet
+        self.paytable = paytable
+
+        # Résultat de chaque combinaison possible, indexée par sa valeur en base len(SLOT_SYMBOLS)
+        self.outcomes = [self._evaluate(combo) for combo in product(range(len(SLOT_SYMBOLS)), repeat=reels)]
+        self.frequencies = [0] * (len(paytable) + 1)
+        for o in self.outcomes:
+            self.frequencies[o] += 1
+
+    def __repr__(self):
+        return f'<SlotTier {self.name} reels={self.reels}>'
+
+    def _evaluate(self, combo: Tuple[int]) -> int:
+        mid = [SLOT_SYMBOLS[i] for i in combo]
+        fruitcount = 0
+        for f in SLOT_FRUITS:
+            if mid.count(f) >= 2:
+                fruitcount = mid.count(f)
+                break
+        for n, (symbol, counts, _, _) in enumerate(self.paytable):
+            count = fruitcount if symbol == 'fruit' else mid.count(symbol)
+            if count in counts:
+                return n
+        return len(self.paytable)
+
+    @property
+    def combinations(self) -> int:
+        return len(self.outcomes)
+
+    def accepts(self, bet: int) -> bool:
+        return self.min_bet <= bet <= self.max_bet
+
+    def rule(self, outcome: int) -> Optional[tuple]:
+        """Renvoie la règle correspondant au résultat, ou None si aucune ne s'applique"""
+        return self.paytable[outcome] if outcome < len(self.paytable) else None
+
+    def payout(self, outcome: int, bet: int) -> int:
+        """Renvoie la somme rendue au joueur (mise comprise) pour ce résultat"""
+        rule = self.rule(outcome)
+        return bet * rule[2] + rule[3] if rule else 0
+
+    def label(self, outcome: int) -> str:
+        """Renvoie le texte de résultat, à formatter avec la somme gagnée"""
+        rule = self.rule(outcome)
+        if not rule:
+            return "Rien · Vous perdez votre mise"
+        symbol, counts, mult, bonus = rule
+        if not mult and not bonus:
+            return f"Zap {symbol} · Vous perdez votre mise"
+        return f"{counts[0]}x {symbol} · Vous gagnez {{}}"
+
+    def table(self) -> List[tuple]:
+        """Renvoie le tableau des gains (emoji, nombre, gain) à afficher aux joueurs"""
+        order = ['fruit', '🍀', '💎', '⚡']
+        rows = []
+        for symbol, counts, mult, bonus in self.paytable:
+            emoji = '🍒' if symbol == 'fruit' else symbol
+            if not mult and not bonus:
+                rows.append((order.index(symbol), max(counts) + 0.5, (emoji, f"<{max(counts) + 1}", "Mise perdue")))
+            else:
+                gain = f"Mise + {bonus}" if mult == 1 else f"Mise x{mult}"
+                rows.append((order.index(symbol), counts[0], (emoji, f"x{counts[0]}", gain)))
+        return [r[2] for r in sorted(rows, key=lambda r: r[:2])]
+
+    def spin(self, rng: random.Random = random) -> Tuple[List[tuple], int]:
+        """Tire les rouleaux et renvoie les colonnes affichées (symboles précédent, central et suivant) et le résultat"""
+        n = len(SLOT_SYMBOLS)
+        stops = [rng.randrange(n) for _ in range(self.reels)]
+        cols = [(SLOT_SYMBOLS[(i - 1) % n], SLOT_SYMBOLS[i], SLOT_SYMBOLS[(i + 1) % n]) for i in stops]
+        code = 0
+        for i in stops:
+            code = code * n + i
+        return cols, self.outcomes[code]
+
+    def expected_return(self, bet: int) -> float:
+        """Calcule exactement le taux de redistribution (somme rendue moyenne / mise) pour une mise donnée"""
+        total = sum(freq * self.payout(o, bet) for o, freq in enumerate(self.frequencies))
+        return total / self.combinations / bet
+
+    def house_edge(self, bet: int) -> float:
+        return 1 - self.expected_return(bet)
+
+    def simulate(self, bet: int, spins: int, seed: int = None) -> dict:
+        """Simule un grand nombre de tirages et renvoie la somme misée, la somme rendue et le taux de redistribution observé
+
+        Utilise NumPy lorsqu'il est installé, sinon se rabat sur une boucle Python (bien plus lente)"""
+        returned = squares = 0
+        if np is not None:
+            rng = np.random.default_rng(seed)
+            n = len(SLOT_SYMBOLS)
+            weights = n ** np.arange(self.reels - 1, -1, -1)
+            outcomes = np.array(self.outcomes, dtype=np.int64)
+            payouts = np.array([self.payout(o, bet) for o in range(len(self.frequencies))], dtype=np.int64)
+            done = 0
+            while done < spins:
+                size = min(SIMULATION_CHUNK_SIZE, spins - done)
+                codes = rng.integers(0, n, size=(size, self.reels)) @ weights
+                results = payouts[outcomes[codes]]
+                returned += int(results.sum())
+                squares += int((results * results).sum())
+                done += size
+        else:
+            rng = random.Random(seed)
+            payouts = [self.payout(o, bet) for o in range(len(self.frequencies))]
+            for _ in range(spins):
+                p = payouts[self.spin(rng)[1]]
+                returned += p
+                squares += p * p
+        mean = returned / spins if spins else 0
+        return {'spins': spins,
+                'wagered': bet * spins,
+                'returned': returned,
+                'rtp': returned / (bet * spins) if spins else 0,
+                'variance': squares / spins - mean ** 2 if spins else 0}
+
+
+SLOT_TIERS = [
+    SlotTier('N1', 3, 5, 100, [
+        ('⚡', (3,), 30, 0),
+        ('⚡', (1, 2), 0, 0),
+        ('💎', (3,), 20, 0),
+        ('💎', (2,), 10, 0),
+        ('🍀', (3,), 5, 0),
+        ('🍀', (2,), 1, 200),
+        ('fruit', (3,), 3, 0),
+        ('fruit', (2,), 1, 50)
+    ]),
+    SlotTier('N2', 4, 101, 500, [
+        ('⚡', (4,), 60, 0),
+        ('⚡', (1, 2, 3), 0, 0),
+        ('💎', (4,), 30, 0),
+        ('💎', (3,), 15, 0),
+        ('🍀', (4,), 10, 0),
+        ('🍀', (3,), 1, 1000),
+        ('fruit', (4,), 5, 0),
+        ('fruit', (3,), 1, 250)
+    ]),
+    SlotTier('N3', 5, 501, 1000, [
+        ('⚡', (5,), 100, 0),
+        ('⚡', (1, 2, 3, 4), 0, 0),
+        ('💎', (5,), 50, 0),
+        ('💎', (4,), 25, 0),
+        ('🍀', (5,), 20, 0),
+        ('🍀', (4,), 10, 0),
+        ('🍀', (3,), 1, 5000),
+        ('fruit', (5,), 10, 0),
+        ('fruit', (4,), 5, 0),
+        ('fruit', (3,), 1, 500)
+    ])
+]
+
+
+def get_slot_tier(bet: int) -> Optional[SlotTier]:
+    """Renvoie le niveau de machine à sous correspondant à la mise, ou None si elle est invalide"""
+    for tier in SLOT_TIERS:
+        if tier.accepts(bet):
+            return tier
+    return None
+
+
+def roll_dices(rng: random.Random = random) -> Tuple[List[int], List[int]]:
+    """Lance les deux dés du joueur puis ceux du bot"""
+    return [rng.randint(1, 6), rng.randint(1, 6)], [rng.randint(1, 6), rng.randint(1, 6)]
+
+
+def dices_result(user_dices: List[int], bot_dices: List[int], choice: str, bet: int) -> int:
+    """Renvoie la variation de solde du joueur ayant parié `choice` (plus ou moins que le bot)
+
+    En cas d'égalité la mise est conservée, une victoire rapporte la moitié de la mise et une défaite la fait perdre"""
+    user, bot = sum(user_dices), sum(bot_dices)
+    if user == bot:
+        return 0
+    if (choice == DICES_CHOICES[0]) == (user > bot):
+        return round(bet / 2)
+    return -bet
@@ -1,9 +1,14 @@
 import logging
 import asyncio
+import bisect
+import heapq
+import re
 import time
+import unicodedata
 from datetime import datetime
 
 import discord
+from discord.ext import tasks
 from typing import List
 
 from redbot.core import Config, commands, checks
@@ -14,6 +19,215 @@ from tabulate import tabulate
 
 logger = logging.getLogger("red.RedX.Shops")
 
+LOGS_PARTITION = 86400
+LOGS_RETENTION = 2592000 # Les logs de vente sont conservés 30 jours, les contrats jusqu'à leur expiration
+MANUALIDS_EXPIRATION = 86400
+CONTRACT_SIGNING_DELAY = 300
+CONTRACT_UPDATE_DEBOUNCE = 2.0
+CONTRACT_FIELD_MEMBERS = 15
+MARKET_FUZZY_THRESHOLD = 0.5
+MARKET_RESULTS = 15
+
+
+def log_partition(logid) -> int:
+    """Renvoie le numéro de la partition journalière contenant le log (les ID sont des timestamps en centièmes de seconde)"""
+    return int(logid) // (LOGS_PARTITION * 100)
+
+
+def logs_horizon() -> int:
+    """Renvoie la plus ancienne partition dont les logs de vente sont encore conservés"""
+    return log_partition(int((time.time() - LOGS_RETENTION) * 100))
+
+
+class LogIndex:
+    """Index en mémoire des logs d'un serveur
+    
+    Garde le dernier ID attribué, l'échéancier des contrats (tas trié par date d'expiration), la liste des logs de chaque membre
+    et la plus ancienne partition dont les logs de vente sont conservés"""
+    
+    def __init__(self, horizon: int = 0):
+        self.horizon = horizon
+        self.last_id = 0
+        self.contracts = []
+        self.expirations = {}
+        self.members = {}
+        
+    def next_id(self) -> str:
+        """Renvoie un nouvel ID de log unique, dérivé de l'heure actuelle"""
+        self.last_id = max(int(time.time() * 100), self.last_id + 1)
+        return str(self.last_id)
+        
+    def add(self, logid: str, log: dict):
+        self.last_id = max(self.last_id, int(logid))
+        if 'expiration_date' in log:
+            self.expirations[logid] = log['expiration_date']
+            heapq.heappush(self.contracts, (log['expiration_date'], logid))
+            members = log['members']
+        else:
+            members = {log['buyer'], log['seller']}
+        for m in members:
+            self.members.setdefault(m, []).append(logid)
+        
+    def remove(self, logid: str, log: dict):
+        self.expirations.pop(logid, None)
+        members = log['members'] if 'expiration_date' in log else {log['buyer'], log['seller']}
+        for m in members:
+            if logid in self.members.get(m, []):
+                self.members[m].remove(logid)
+                
+    def expired(self, now: float) -> List[str]:
+        """Retire de l'échéancier et renvoie les ID des contrats expirés"""
+        expired = []
+        while self.contracts and self.contracts[0][0] < now:
+            exp, logid = heapq.heappop(self.contracts)
+            if self.expirations.get(logid) == exp:
+                expired.append(logid)
+        return expired
+    
+    def member_contracts(self, member_id: int) -> List[str]:
+        """Renvoie les ID des contrats actifs dont le membre est partie, du plus ancien au plus récent"""
+        return [l for l in self.members.get(member_id, []) if l in self.expirations]
+
+
+def search_tokens(text: str) -> List[str]:
+    """Découpe un texte en mots normalisés (minuscules, sans accents) pour la recherche"""
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return [t for t in re.findall(r'\w+', text) if len(t) > 1]
+
+
+def trigrams(token: str) -> set:
+    token = f' {token} '
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+class MarketIndex:
+    """Index de recherche des items en vente sur un serveur
+    
+    Les mots des noms et descriptions sont indexés tels quels et par trigrammes (pour tolérer les fautes de frappe),
+    et les prix sont gardés triés pour filtrer par fourchette de prix. Les items en rupture de stock ne sont pas indexés"""
+    
+    def __init__(self):
+        self.names = {}
+        self.descriptions = {}
+        self.grams = {}
+        self.prices = []
+        self.terms = {}
+        
+    def add(self, itemid: str, item: dict):
+        self.remove(itemid)
+        if item.get('qte') == 0:
+            return
+        name, desc = set(search_tokens(item['name']) + search_tokens(itemid)), set(search_tokens(item.get('description', '')))
+        grams = set().union(*[trigrams(t) for t in name | desc])
+        for t in name:
+            self.names.setdefault(t, set()).add(itemid)
+        for t in desc:
+            self.descriptions.setdefault(t, set()).add(itemid)
+        for g in grams:
+            self.grams.setdefault(g, set()).add(itemid)
+        bisect.insort(self.prices, (item['value'], itemid))
+        self.terms[itemid] = (name, desc, grams, item['value'])
+        
+    def remove(self, itemid: str):
+        if itemid not in self.terms:
+            return
+        name, desc, grams, value = self.terms.pop(itemid)
+        for index, keys in ((self.names, name), (self.descriptions, desc), (self.grams, grams)):
+            for k in keys:
+                index[k].discard(itemid)
+                if not index[k]:
+                    del index[k]
+        i = bisect.bisect_left(self.prices, (value, itemid))
+        if i < len(self.prices) and self.prices[i] == (value, itemid):
+            del self.prices[i]
+            
+    def price_range(self, min_price: int = None, max_price: int = None) -> List[str]:
+        """Renvoie les items dont le prix est compris dans la fourchette, du moins cher au plus cher"""
+        lo = bisect.bisect_left(self.prices, (min_price, '')) if min_price is not None else 0
+        hi = bisect.bisect_left(self.prices, (max_price + 1, '')) if max_price is not None else len(self.prices)
+        return [itemid for _, itemid in self.prices[lo:hi]]
+        
+    def search(self, query: str, min_price: int = None, max_price: int = None, limit: int = MARKET_RESULTS) -> List[tuple]:
+        """Renvoie les meilleurs résultats (ID d'item, score) pour la recherche, filtrés par prix
+        
+        Un mot trouvé dans le nom compte plus qu'un mot de la description, et un mot approchant compte selon la part de trigrammes en commun"""
+        tokens = search_tokens(query)
+        if not tokens:
+            return [(itemid, 0) for itemid in self.price_range(min_price, max_price)[:limit]]
+        
+        scores = {}
+        for t in tokens:
+            matched = {}
+            for itemid in self.names.get(t, ()):
+                matched[itemid] = 3
+            for itemid in self.descriptions.get(t, ()):
+                matched[itemid] = max(matched.get(itemid, 0), 2)
+            qgrams = trigrams(t)
+            shared = {}
+            for g in qgrams:
+                for itemid in self.grams.get(g, ()):
+                    shared[itemid] = shared.get(itemid, 0) + 1
+            for itemid, n in shared.items():
+                if n / len(qgrams) >= MARKET_FUZZY_THRESHOLD:
+                    matched[itemid] = max(matched.get(itemid, 0), n / len(qgrams))
+            for itemid, score in matched.items():
+                scores[itemid] = scores.get(itemid, 0) + score
+                
+        results = []
+        for itemid, score in scores.items():
+            value = self.terms[itemid][3]
+            if (min_price is None or value >= min_price) and (max_price is None or value <= max_price):
+                results.append((itemid, score))
+        return sorted(results, key=lambda r: (-r[1], self.terms[r[0]][3]))[:limit]
+
+
+class ContractSigning:
+    """Signature d'un contrat en cours : les signatures sont reçues par événement et l'affichage est rafraîchi au plus
+    une fois toutes les CONTRACT_UPDATE_DEBOUNCE secondes, quel que soit le nombre de signataires"""
+    
+    def __init__(self, message: discord.Message, members: List[discord.Member], render):
+        self.message = message
+        self.members = members
+        self.pending = {m.id for m in members}
+        self.signed = set()
+        self.render = render
+        self.completed = asyncio.Event()
+        self.update_task = None
+        self.task = None
+        
+    def sign(self, user_id: int) -> bool:
+        """Enregistre la signature du membre et renvoie True si elle est nouvelle"""
+        if user_id not in self.pending:
+            return False
+        self.pending.discard(user_id)
+        self.signed.add(user_id)
+        if not self.pending:
+            self.completed.set()
+        elif not self.update_task or self.update_task.done():
+            self.update_task = asyncio.create_task(self.update())
+        return True
+    
+    async def update(self):
+        await asyncio.sleep(CONTRACT_UPDATE_DEBOUNCE)
+        if self.completed.is_set():
+            return
+        try:
+            await self.message.edit(embed=self.render(self.signed))
+        except discord.HTTPException:
+            pass
+        
+    async def wait(self, timeout: float) -> bool:
+        """Attend que toutes les parties aient signé, renvoie False si le délai est dépassé"""
+        try:
+            await asyncio.wait_for(self.completed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            if self.update_task:
+                self.update_task.cancel()
+        return True
+
 
 class Shops(commands.Cog):
     """Système de boutiques personnalisées"""
@@ -31,63 +245,230 @@ class Shops(commands.Cog):
         self.config.register_member(**default_member)
         self.config.register_guild(**default_guild)
         
+        self.config.init_custom('Logs', 2)
+        self.config.register_custom('Logs', Entries={})
+        
+        self.items = {}
+        self.markets = {}
+        self.logs = {}
+        self.manual_deadlines = {}
+        self.signings = {}
+        
+        self.shops_manualids_loop.start()
+        
+    def cog_unload(self):
+        self.shops_manualids_loop.cancel()
+        for signing in self.signings.values():
+            if signing.task:
+                signing.task.cancel()
+            
+    @commands.Cog.listener()
+    async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
+        if payload.message_id in self.signings and payload.emoji.name == '✅':
+            self.signings[payload.message_id].sign(payload.user_id)
+        
+    @tasks.loop(minutes=1.0)
+    async def shops_manualids_loop(self):
+        await self.expire_manualids()
+        for guild_id in list(self.logs):
+            await self.expire_logs(guild_id)
+        
+    @shops_manualids_loop.before_loop
+    async def before_shops_manualids_loop(self):
+        logger.info('Lancement de shops_manualids_loop...')
+        await self.bot.wait_until_ready()
+        all_members = await self.config.all_members()
+        for guild_id, guild_data in all_members.items():
+            for user_id, data in guild_data.items():
+                for opeid, ope in data['ManualIDs'].items():
+                    self.schedule_manualid(guild_id, user_id, opeid, ope['timestamp'])
+                    
+    def schedule_manualid(self, guild_id: int, seller_id: int, opeid: str, timestamp: float):
+        """Programme l'expiration d'une opération manuelle en attente"""
+        heapq.heappush(self.manual_deadlines.setdefault(guild_id, []), (timestamp + MANUALIDS_EXPIRATION, seller_id, opeid))
+        
+    async def expire_manualids(self, guild: discord.Guild = None):
+        """Supprime les opérations manuelles expirées (une seule écriture par vendeur) et prévient les acheteurs concernés
+        
+        Sans serveur précisé, traite tous les serveurs (réservé à shops_manualids_loop)"""
+        now = time.time()
+        due = {}
+        for guild_id in ([guild.id] if guild else list(self.manual_deadlines)):
+            heap = self.manual_deadlines.get(guild_id, [])
+            while heap and heap[0][0] <= now:
+                _, seller_id, opeid = heapq.heappop(heap)
+                due.setdefault((guild_id, seller_id), []).append(opeid)
+        
+        for (guild_id, seller_id), opeids in due.items():
+            expired = {}
+            async with self.config.member_from_ids(guild_id, seller_id).ManualIDs() as ids:
+                for opeid in opeids:
+                    if opeid in ids and ids[opeid]['timestamp'] + MANUALIDS_EXPIRATION <= now:
+                        expired[opeid] = ids.pop(opeid)
+                        
+            guild = self.bot.get_guild(guild_id)
+            if not guild:
+                continue
+            seller = guild.get_member(seller_id)
+            for opeid, ope in expired.items():
+                buyer = guild.get_member(ope['buyer'])
+                if not buyer:
+                    continue
+                try:
+                    await buyer.send(f"**Demande d'achat expirée** • Votre demande d'achat de x{ope['qte']} `{ope['item']}` "
+                                     f"auprès de {seller.name if seller else '???'} sur *{guild.name}* n'a pas été acceptée dans les 24h et a été annulée.")
+                except discord.HTTPException:
+                    pass
+        
+    async def get_item_index(self, guild: discord.Guild) -> dict:
+        """Renvoie l'index des items en vente sur le serveur (ID d'item -> (ID du vendeur, données de l'item))
+        
+        L'index est construit au premier appel puis tenu à jour par les fonctions de modification des boutiques"""
+        if guild.id not in self.items:
+            all_members = await self.config.all_members(guild)
+            self.items[guild.id] = {i: (m, all_members[m]['Shop'][i]) for m in all_members for i in all_members[m]['Shop']}
+            self.markets[guild.id] = MarketIndex()
+            for itemid, (_, item) in self.items[guild.id].items():
+                self.markets[guild.id].add(itemid, item)
+        return self.items[guild.id]
+    
+    async def get_market_index(self, guild: discord.Guild) -> MarketIndex:
+        """Renvoie l'index de recherche des items en vente sur le serveur"""
+        await self.get_item_index(guild)
+        return self.markets[guild.id]
+        
     async def check_key_validity(self, guild: discord.Guild, key: str):
-        all_members = await self.config.all_members(guild)
-        all_shops = [all_members[u]['Shop'] for u in all_members]
-        all_keys = [i for s in all_shops for i in s]
-        return not (key in all_keys)
+        return key not in await self.get_item_index(guild)
     
     async def is_shop_item(self, guild: discord.Guild, itemid: str):
-        all_members = await self.config.all_members(guild)
-        for m in all_members:
-            for i in all_members[m]['Shop']:
-                if i == itemid:
-                    return True
-        return False
+        return itemid in await self.get_item_index(guild)
     
     async def get_shop_item(self, guild: discord.Guild, itemid: str):
-        all_members = await self.config.all_members(guild)
-        for m in all_members:
-            for i in all_members[m]['Shop']:
-                if i == itemid:
-                    return guild.get_member(m), all_members[m]['Shop'][i]
+        index = await self.get_item_index(guild)
+        if itemid in index:
+            seller, item = index[itemid]
+            return guild.get_member(seller), dict(item)
         return None, None
     
-    async def clear_manualids(self, member: discord.Member):
-        ids = await self.config.member(member).ManualIDs()
-        for i in ids:
-            if ids[i]['timestamp'] + 86400 < time.time():
-                await self.config.member(member).ManualIDs.clear_raw(i)
+    async def set_shop_item(self, member: discord.Member, itemid: str, itemdata: dict):
+        """Ajoute ou remplace un item dans la boutique du membre"""
+        await self.config.member(member).Shop.set_raw(itemid, value=itemdata)
+        index = await self.get_item_index(member.guild)
+        index[itemid] = (member.id, dict(itemdata))
+        self.markets[member.guild.id].add(itemid, itemdata)
+        
+    async def set_shop_item_quantity(self, member: discord.Member, itemid: str, qte: int):
+        """Modifie la quantité disponible d'un item de la boutique du membre"""
+        await self.config.member(member).Shop.set_raw(itemid, 'qte', value=qte)
+        index = await self.get_item_index(member.guild)
+        if itemid in index:
+            index[itemid][1]['qte'] = qte
+            self.markets[member.guild.id].add(itemid, index[itemid][1])
+            
+    async def delete_shop_item(self, member: discord.Member, itemid: str):
+        """Retire un item de la boutique du membre"""
+        await self.config.member(member).Shop.clear_raw(itemid)
+        index = await self.get_item_index(member.guild)
+        index.pop(itemid, None)
+        self.markets[member.guild.id].remove(itemid)
+        
+    async def clear_shop(self, member: discord.Member):
+        """Retire tous les items de la boutique du membre"""
+        await self.config.member(member).Shop.clear()
+        index = await self.get_item_index(member.guild)
+        for itemid in [i for i in index if index[i][0] == member.id]:
+            del index[itemid]
+            self.markets[member.guild.id].remove(itemid)
+    
+    async def get_log_index(self, guild: discord.Guild) -> LogIndex:
+        """Renvoie l'index des logs du serveur, construit au premier appel
+        
+        Les logs encore stockés dans l'ancien dictionnaire 'GlobalLogs' sont d'abord déplacés dans leurs partitions,
+        et les logs de vente des partitions plus anciennes que LOGS_RETENTION sont supprimés sans être indexés"""
+        if guild.id not in self.logs:
+            legacy = await self.config.guild(guild).GlobalLogs()
+            async with self.config.custom('Logs', str(guild.id)).all() as tree:
+                for logid, log in legacy.items():
+                    tree.setdefault(str(log_partition(logid)), {}).setdefault('Entries', {})[logid] = log
+                index = LogIndex(logs_horizon())
+                for day in sorted(tree, key=int):
+                    entries = tree[day].get('Entries', {})
+                    if int(day) < index.horizon:
+                        for logid in [l for l in entries if 'expiration_date' not in entries[l]]:
+                            del entries[logid]
+                        if not entries:
+                            del tree[day]
+                            continue
+                    for logid in sorted(entries, key=int):
+                        index.add(logid, entries[logid])
+            if legacy:
+                await self.config.guild(guild).GlobalLogs.clear()
+            self.logs[guild.id] = index
+        return self.logs[guild.id]
+    
+    def _logs_group(self, guild: discord.Guild, logid: str):
+        return self.config.custom('Logs', str(guild.id), str(log_partition(logid))).Entries
+    
+    async def add_log(self, guild: discord.Guild, log: dict) -> str:
+        """Enregistre un log dans sa partition journalière et renvoie son ID"""
+        index = await self.get_log_index(guild)
+        uid = index.next_id()
+        await self._logs_group(guild, uid).set_raw(uid, value=log)
+        index.add(uid, log)
+        return uid
+    
+    async def get_log(self, guild: discord.Guild, logid: str) -> dict:
+        """Renvoie les données d'un log à partir de son ID, ou None s'il n'existe pas"""
+        if not logid.isdigit():
+            return None
+        return await self._logs_group(guild, logid).get_raw(logid, default=None)
+    
+    async def delete_log(self, guild: discord.Guild, logid: str):
+        log = await self.get_log(guild, logid)
+        if log:
+            await self._logs_group(guild, logid).clear_raw(logid)
+            (await self.get_log_index(guild)).remove(logid, log)
+            if not await self._logs_group(guild, logid)():
+                await self.config.custom('Logs', str(guild.id), str(log_partition(logid))).clear()
+                
+    async def expire_logs(self, guild_id: int):
+        """Supprime les logs de vente des partitions sorties de la durée de conservation depuis le dernier passage
+        
+        Les contrats sont conservés jusqu'à leur expiration, une partition vide est entièrement supprimée"""
+        index = self.logs.get(guild_id)
+        horizon = logs_horizon()
+        if not index or index.horizon >= horizon:
+            return
+        for day in range(index.horizon, horizon):
+            async with self.config.custom('Logs', str(guild_id), str(day)).Entries() as entries:
+                for logid in [l for l in entries if 'expiration_date' not in entries[l]]:
+                    index.remove(logid, entries.pop(logid))
+                empty = not entries
+            if empty:
+                await self.config.custom('Logs', str(guild_id), str(day)).clear()
+        index.horizon = horizon
     
     async def log_shop_operation(self, buyer: discord.Member, seller: discord.Member, itemid: str, qte: int, **info):
         """Log une opération de vente"""
-        uid = str(int(time.time() * 100))
         log = {'buyer': buyer.id, 'seller': seller.id, 'item': itemid, 'qte': qte, 'timestamp': time.time()}
         log.update(info)
-        
-        await self.config.guild(buyer.guild).GlobalLogs.set_raw(uid, value=log)
-        return uid
+        return await self.add_log(buyer.guild, log)
     
     async def log_contract(self, guild: discord.Guild, members: List[discord.Member], content: str, expiration_date: float, credits: int = None, **info):
         """Log un contrat manuel"""
-        uid = str(int(time.time() * 100))
         log = {'members': [m.id for m in members], 'content': content, 'expiration_date': expiration_date, 'credits': credits, 'timestamp': time.time()}
         log.update(info)
-        
-        await self.config.guild(guild).GlobalLogs.set_raw(uid, value=log)
-        return uid
+        return await self.add_log(guild, log)
     
     async def clear_expired_contracts(self, guild: discord.Guild):
-        logs = await self.config.guild(guild).GlobalLogs()
-        for l in logs:
-            if 'expiration_date' in logs[l]:
-                if logs[l]['expiration_date'] < time.time():
-                    await self.config.guild(guild).GlobalLogs.clear_raw(l)
+        index = await self.get_log_index(guild)
+        for logid in index.expired(time.time()):
+            await self.delete_log(guild, logid)
+            index.expirations.pop(logid, None)
 
     async def get_log_ticket(self, guild: discord.Guild, logid: str) -> discord.Embed:
-        logs = await self.config.guild(guild).GlobalLogs()
-        if logid in logs:
-            log = logs[logid]
+        log = await self.get_log(guild, logid)
+        if log:
             if not 'buyer' in log:
                 return None
             buyer = guild.get_member(log['buyer'])
@@ -107,9 +488,8 @@ class Shops(commands.Cog):
     
     async def get_contract_info(self, guild: discord.Guild, con_id: str) -> discord.Embed:
         await self.clear_expired_contracts(guild)
-        logs = await self.config.guild(guild).GlobalLogs()
-        if con_id in logs:
-            log = logs[con_id]
+        log = await self.get_log(guild, con_id)
+        if log and 'expiration_date' in log:
             members = [guild.get_member(m) for m in log['members']]
             
             em = discord.Embed(title=f"**Contrat** · `${con_id}`", color=discord.Color.dark_grey(), timestamp=datetime.utcfromtimestamp(log['timestamp']))
@@ -165,6 +545,44 @@ class Shops(commands.Cog):
         else:
             return await ctx.reply(f"**Boutique vide** • *{user.name}* n'a aucun élément à proposer", mention_author=False)
         
+    @member_shop_commands.command(name='search', aliases=['find'])
+    async def search_shop_items(self, ctx, *, query: str = ''):
+        """Rechercher un item parmi toutes les boutiques du serveur
+        
+        La recherche tolère les fautes de frappe et porte sur les identifiants, noms et descriptions des items
+        Ajoutez `<prix`, `>prix` ou `min-max` à la recherche pour filtrer par prix à l'unité (ex. `;shop search épée <500`)"""
+        min_price = max_price = None
+        words = []
+        for word in query.split():
+            if re.fullmatch(r'<\d+', word):
+                max_price = int(word[1:])
+            elif re.fullmatch(r'>\d+', word):
+                min_price = int(word[1:])
+            elif re.fullmatch(r'\d+-\d+', word):
+                min_price, max_price = map(int, word.split('-'))
+            else:
+                words.append(word)
+                
+        market = await self.get_market_index(ctx.guild)
+        index = await self.get_item_index(ctx.guild)
+        results = market.search(' '.join(words), min_price, max_price)
+        if not results:
+            return await ctx.reply(f"**Aucun résultat** • Aucun item en vente ne correspond à votre recherche", mention_author=False)
+        
+        eco = self.bot.get_cog('AltEco')
+        curr = await eco.get_currency(ctx.guild)
+        tbl = []
+        for itemid, _ in results:
+            seller, item = index[itemid]
+            seller = ctx.guild.get_member(seller)
+            name = item['name'] if len(item['name']) <= 25 else item['name'][:25] + '...'
+            tbl.append((itemid, name, f"{item['value']}{curr}", item.get('qte', '∞'), seller.name if seller else '???'))
+        em = discord.Embed(title=f"Recherche dans les boutiques de {ctx.guild.name}",
+                           description=box(tabulate(tbl, headers=('ID', 'Nom', 'Prix', 'Qte', 'Vendeur'))),
+                           color=await ctx.embed_color())
+        em.set_footer(text=f"{len(results)} meilleur{'s' if len(results) > 1 else ''} résultat{'s' if len(results) > 1 else ''} · Achetez avec ;shop buy <ID>")
+        await ctx.reply(embed=em, mention_author=False)
+        
     @member_shop_commands.command(name='buy')
     @commands.cooldown(1, 20, commands.BucketType.member)
     async def buy_shop_item(self, ctx, itemid: str, qte: int = 1):
@@ -214,6 +632,7 @@ class Shops(commands.Cog):
             buyid = str(int(time.time() * 10))
             manualdata = {'item': itemid, 'qte': qte, 'buyer': ctx.author.id, 'timestamp': time.time()}
             await self.config.member(seller).ManualIDs.set_raw(buyid, value=manualdata)
+            self.schedule_manualid(ctx.guild.id, seller.id, buyid, manualdata['timestamp'])
             
             sellem = discord.Embed(title=f"Demande d'achat · `{itemid}` **{item['name']}**", description=f"**{ctx.author}** sur *{ctx.guild.name}* désire acheter l'item **x{qte}** `{itemid}`.", color=seller.color)
             if 'qte' in item:
@@ -235,7 +654,7 @@ class Shops(commands.Cog):
             await eco.deposit_credits(seller, item['value'] * qte, desc=f"Vente boutique ${uid}")
             
             if 'qte' in item:
-                await self.config.member(seller).Shop.set_raw(itemid, 'qte', value=item['qte'] - qte)
+                await self.set_shop_item_quantity(seller, itemid, item['qte'] - qte)
             
             return await ctx.reply(f"**Achat effectué** • Vous avez acheté x{qte} **{item['name']}** à {seller.mention} pour {qte * item['value']}{curr}.", embed=await self.get_log_ticket(ctx.guild, uid))
             
@@ -246,7 +665,7 @@ class Shops(commands.Cog):
         Cette acceptation doit être faite dans les 24h après la demande, sans quoi l'opération est automatiquement annulée
         Ne pas mettre d'ID d'opération vous affiche celles qui sont en attente"""
         author = ctx.author
-        await self.clear_manualids(author)
+        await self.expire_manualids(ctx.guild)
         ids = await self.config.member(author).ManualIDs()
         eco = self.bot.get_cog('AltEco')
         curr = await eco.get_currency(ctx.guild)
@@ -301,7 +720,7 @@ class Shops(commands.Cog):
                     await eco.deposit_credits(ctx.author, item['value'] * data['qte'], desc=f"Vente boutique ${uid}")
                     
                     if 'qte' in item:
-                        await self.config.member(ctx.author).Shop.set_raw(itemid, 'qte', value=item['qte'] - data['qte'])
+                        await self.set_shop_item_quantity(ctx.author, itemid, item['qte'] - data['qte'])
                     
                     return await ctx.reply(f"**Vente effectuée** • Vous avez vendu x{data['qte']} **{item['name']}** à {buyer.mention} pour {data['qte'] * item['value']}{curr}.", embed=await self.get_log_ticket(ctx.guild, uid))
             else:
@@ -435,7 +854,7 @@ class Shops(commands.Cog):
         if img:
             itemdata['img'] = img
 
-        await self.config.member(author).Shop.set_raw(itemid, value=itemdata)
+        await self.set_shop_item(author, itemid, itemdata)
         if sellmode is 'auto':
             await ctx.send(f"✅ **Succès** • L'item `{itemid}` a été ajouté dans votre boutique !")
         else:
@@ -455,7 +874,7 @@ class Shops(commands.Cog):
         if 'qte' not in item:
             return await ctx.reply(f"**Action impossible** • Cet item n'est pas dénombrable. Si vous voulez qu'il soit quantifié, vous devez l'effacer avec `;shop remove` et le refaire avec `;shop new`", mention_author=False)
         
-        await self.config.member(user).Shop.set_raw(itemid, 'qte', value=item['qte'] + qte)
+        await self.set_shop_item_quantity(user, itemid, item['qte'] + qte)
         await ctx.reply(f"**Ajout effectué** • L'item `{itemid}` est désormais disponible en x{item['qte'] + qte} exemplaires", mention_author=False)    
     
     @member_shop_commands.command(name='remove', aliases=['rem'])
@@ -465,7 +884,7 @@ class Shops(commands.Cog):
         Préciser [qte] permet de retirer une certaine quantité de l'item si celui-ci est dénombrable"""
         user = ctx.author
         shop = await self.config.member(user).Shop()
-        await self.clear_manualids(user)
+        await self.expire_manualids(ctx.guild)
         manualids = await self.config.member(user).ManualIDs()
         
         if itemid not in shop:
@@ -474,10 +893,10 @@ class Shops(commands.Cog):
         item = shop[itemid]
         if qte and 'qte' in item:
             if qte < item['qte']:
-                await self.config.member(user).Shop.set_raw(itemid, 'qte', value = item['qte'] - qte)
+                await self.set_shop_item_quantity(user, itemid, item['qte'] - qte)
                 txt = f"**Quantité réduite** • L'item *{item['name']}* (`{itemid}`) n'est désormais disponible qu'en {item['qte'] - qte} exemplaires"
             elif qte == item['qte']:
-                await self.config.member(user).Shop.clear_raw(itemid)
+                await self.delete_shop_item(user, itemid)
                 txt = f"**Item supprimé** • L'item *{item['name']}* (`{itemid}`) n'est désormais plus disponible dans votre boutique (quantité nulle)"
                 
                 for mid in manualids:
@@ -487,7 +906,7 @@ class Shops(commands.Cog):
                 txt = f"**Erreur** • L'item *{item['name']}* (`{itemid}`) n'est disponible qu'en {item['qte']} exemplaires et vous tentez d'en retirer {qte} ce qui est impossible"
             await ctx.reply(txt, mention_author=False)
         else:
-            await self.config.member(user).Shop.clear_raw(itemid)
+            await self.delete_shop_item(user, itemid)
             await ctx.reply(f"**Item supprimé** • L'item *{item['name']}* (`{itemid}`) n'est désormais plus disponible dans votre boutique", mention_author=False)
             
             for mid in manualids:
@@ -498,7 +917,7 @@ class Shops(commands.Cog):
     async def shop_reset(self, ctx):
         """Reset entièrement votre boutique"""
         user = ctx.author
-        await self.config.member(user).Shop.clear()
+        await self.clear_shop(user)
         await ctx.reply("**Reset effectué** • Tous les items de votre boutique ont été retirés.")
         
     @commands.command(name="preuve", aliases=['proof'])
@@ -579,65 +998,77 @@ class Shops(commands.Cog):
                 return await ctx.send("**Date invalide** • Impossible de mettre une date trop proche (<1h avec maintenant) ou déjà passée")
         await asyncio.sleep(0.5)
         
-        lm = {m.id : False for m in members}
-        msg = None
-        timeout = time.time() + 300
-        while time.time() <= timeout and not all([lm[i] for i in lm]):
-            lm_emojis = [(ctx.guild.get_member(i), '✅' if lm[i] else '❎') for i in lm]
-            resume = f"__**Objet du contrat :**__ {content}\n**__Crédits concernés :__** {creditssum if creditssum else '0'}{curr}\n**__Expire le :__** {exp_txt}"
+        resume = f"__**Objet du contrat :**__ {content}\n**__Crédits concernés :__** {creditssum if creditssum else '0'}{curr}\n**__Expire le :__** {exp_txt}"
+        
+        def render(signed: set, color=discord.Color.dark_gray(), footer: str = "››› En attente de la confirmation de chaque membre partie au contrat [Valide 5m]"):
             em = discord.Embed(title=f"Résumé du contrat créé",
-                            description=resume,
-                            color=discord.Color.dark_gray())
-            em.add_field(name="Parties au contrat", value=box(tabulate(lm_emojis, headers=('Membre', 'Accepté ?'))))
-            em.set_footer(text="››› En attente de la confirmation de chaque membre partie au contrat [Valide 5m]")
-            if not msg:
-                msg = await ctx.send(embed=em)
-                start_adding_reactions(msg, ['✅'])
-            else:
-                await msg.edit(embed=em)
+                               description=resume,
+                               color=color)
+            rows = [(m, '✅' if m.id in signed else '❎') for m in members]
+            for i in range(0, len(rows), CONTRACT_FIELD_MEMBERS):
+                em.add_field(name="Parties au contrat" if not i else "Parties au contrat (suite)",
+                             value=box(tabulate(rows[i:i + CONTRACT_FIELD_MEMBERS], headers=('Membre', 'Accepté ?'))), inline=False)
+            em.set_footer(text=footer)
+            return em
+        
+        members = list(dict.fromkeys(members))
+        msg = await ctx.send(embed=render(set()))
+        signing = ContractSigning(msg, members, render)
+        self.signings[msg.id] = signing
+        start_adding_reactions(msg, ['✅'])
+        signing.task = asyncio.create_task(self.conclude_contract(ctx, signing, content, expiration_date, creditssum))
+        
+    async def conclude_contract(self, ctx, signing: ContractSigning, content: str, expiration_date: float, creditssum: int):
+        """Attend la signature de toutes les parties puis enregistre le contrat, sans bloquer la commande de création
+        
+        Cette tâche n'étant attendue par personne, toute erreur est journalisée et signalée dans le salon"""
+        try:
+            try:
+                signed = await signing.wait(CONTRACT_SIGNING_DELAY)
+            finally:
+                self.signings.pop(signing.message.id, None)
+            
+            if not signed:
+                try:
+                    await signing.message.delete()
+                except discord.HTTPException:
+                    pass
+                return await ctx.send("**Contrat annulé** • Toutes les parties au contrat n'ont pas accepté dans les temps (5 minutes).")
             
             try:
-                react, ruser = await self.bot.wait_for("reaction_add",
-                                                check=lambda m, u: u in members and m.message.id == msg.id,
-                                                timeout=60)
-            except asyncio.TimeoutError:
-                continue
+                await signing.message.edit(embed=signing.render(signing.signed, discord.Color.green(), "Toutes les parties ont accepté le contrat"))
+            except discord.HTTPException:
+                pass # Le message a pu être supprimé entre temps, le contrat est tout de même enregistré
             
-            if react.emoji == '✅':
-                if not lm[ruser.id]:
-                    lm[ruser.id] = True
-        
-        if not all([lm[i] for i in lm]):
-            await msg.delete()
-            return await ctx.send("**Contrat annulé** • Toutes les parties au contrat n'ont pas accepté dans les temps (5 minutes).")
-        
-        lm_emojis = [(ctx.guild.get_member(i), '✅' if lm[i] else '❎') for i in lm]
-        resume = f"__**Objet du contrat :**__ {content}\n**__Crédits concernés :__** {creditssum if creditssum else '0'}{curr}\n**__Expire le :__** {exp_txt}"
-        em = discord.Embed(title=f"Résumé du contrat créé",
-                        description=resume,
-                        color=discord.Color.green())
-        em.add_field(name="Parties au contrat", value=box(tabulate(lm_emojis, headers=('Membre', 'Accepté ?'))))
-        em.set_footer(text="Toutes les parties ont accepté le contrat")
-        await msg.edit(embed=em)
-        
-        contract = {'members': members, 'content': content, 'expiration_date': expiration_date, 'credits': creditssum if creditssum else None}
-        uid = await self.log_contract(ctx.guild, **contract)
-        await ctx.send(f"✅ **Succès** • Le contrat `${uid}` a été créé et pourra être consulté en entrant la commande `;proof {uid}`", 
-                       embed=await self.get_contract_info(ctx.guild, uid))
+            contract = {'members': signing.members, 'content': content, 'expiration_date': expiration_date, 'credits': creditssum if creditssum else None}
+            uid = await self.log_contract(ctx.guild, **contract)
+            await ctx.send(f"✅ **Succès** • Le contrat `${uid}` a été créé et pourra être consulté en entrant la commande `;proof {uid}`", 
+                           embed=await self.get_contract_info(ctx.guild, uid))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Échec de la conclusion du contrat ({ctx.guild.name}) : {e}", exc_info=True)
+            try:
+                await ctx.send(f"**Erreur** • Le contrat n'a pas pu être conclu : `{e}`")
+            except discord.HTTPException:
+                pass
         
     @commands.command(name="contrats", aliases=['contracts'])
     @commands.guild_only()
     async def get_contracts(self, ctx, member: discord.Member = None):
         """Affiche les ID de tous les contrats dont vous, ou le membre mentionné, est partie"""
         user = member if member else ctx.author
-        logs = await self.config.guild(ctx.guild).GlobalLogs()
+        await self.clear_expired_contracts(ctx.guild)
+        index = await self.get_log_index(ctx.guild)
         ids = []
-        for l in [i for i in logs if 'expiration_date' in logs[i]]:
-            ids.append((l, logs[l]['content'] if len(logs[l]['content']) <= 50 else logs[l]['content'][:50] + '...'))
+        for l in index.member_contracts(user.id)[-30:]:
+            log = await self.get_log(ctx.guild, l)
+            if log:
+                ids.append((l, log['content'] if len(log['content']) <= 50 else log['content'][:50] + '...'))
         
         if ids:
             em = discord.Embed(title=f"Contrats de **{user.name}**", 
-                            description=box(tabulate(ids[-30:], headers=('ID', 'Contenu'))),
+                            description=box(tabulate(ids, headers=('ID', 'Contenu'))),
                             color=discord.Color.dark_grey())
             em.set_footer(text="*30 plus anciens seulement")
             
@@ -650,9 +1081,9 @@ class Shops(commands.Cog):
     @checks.admin_or_permissions(manage_messages=True)
     async def delete_contract(self, ctx, id: str):
         """Supprimer un contrat manuellement"""
-        logs = await self.config.guild(ctx.guild).GlobalLogs()
-        if id in logs:
-            if not logs[id].get('expiration_date', False):
+        log = await self.get_log(ctx.guild, id)
+        if log:
+            if not log.get('expiration_date', False):
                 return await ctx.reply(f"**Erreur** • Cet ID ne provient pas d'un contrat et ne peut donc être supprimé manuellement de cette façon", mention_author=False)
             
             em = await self.get_contract_info(ctx.guild, id)
@@ -667,7 +1098,7 @@ class Shops(commands.Cog):
                 return
             
             if react.emoji == '✅':
-                await self.config.guild(ctx.guild).GlobalLogs.clear_raw(id)
+                await self.delete_log(ctx.guild, id)
                 return await ctx.send(f"**Succès** • Le contrat `${id}` a été supprimé")
             else:
                 await msg.delete()
@@ -27,6 +27,21 @@ from tabulate import tabulate
 
 logger = logging.getLogger("red.RedX.UniBit")
 
+ASSET_SHARD_PREFIX = 2
+ASSET_ID_LENGTH = 8
+STORAGE_SCHEMA = 2
+
+
+def history_snapshot(events: List[dict], seq: int = None) -> dict:
+    """Calcule l'état dérivé de l'historique d'un asset : propriétaire actuel, nombre de transferts et prochain numéro d'opération"""
+    transfers = 0
+    for prev, ope in zip(events, events[1:]):
+        if ope['owner'] != prev['owner']:
+            transfers += 1
+    return {'owner': events[-1]['owner'] if events else None,
+            'transfers': transfers,
+            'seq': seq if seq is not None else len(events)}
+
 
 class AssetItem:
     def __init__(self, raw_data):
@@ -79,7 +94,7 @@ class Asset:
         self._raw = asset_data
         
         self.metadata = self._raw['metadata']
-        self.history = self._raw['history']
+        self.snapshot = self._raw['snapshot']
         
         self.__dict__.update(asset_data)
 
@@ -91,9 +106,13 @@ class Asset:
     
     @property
     def owner(self):
-        last_log = self.history[-1]
-        user = self._cog.bot.get_user(last_log['owner'])
-        return user if user else last_log['owner']
+        owner = self.snapshot['owner']
+        user = self._cog.bot.get_user(owner)
+        return user if user else owner
+    
+    @property
+    def transfers(self):
+        return self.snapshot['transfers']
     
     @property
     def author(self):
@@ -112,6 +131,40 @@ class Asset:
         return int('0x%02X%02X%02X' % (r(),r(),r()), 16)
     
 
+class AssetIndex:
+    """Index des assets par propriétaire actuel et par auteur original (ID utilisateur -> IDs d'assets)"""
+    
+    def __init__(self):
+        self.owners = {}
+        self.authors = {}
+        self.assets = {}
+        
+    def add(self, asset_id: str, author: int, owner: int):
+        self.assets[asset_id] = (author, owner)
+        self.authors.setdefault(author, set()).add(asset_id)
+        self.owners.setdefault(owner, set()).add(asset_id)
+        
+    def move(self, asset_id: str, owner: int):
+        """Change le propriétaire de l'asset dans l'index"""
+        author, old = self.assets[asset_id]
+        if old != owner:
+            self.owners[old].discard(asset_id)
+            self.owners.setdefault(owner, set()).add(asset_id)
+            self.assets[asset_id] = (author, owner)
+            
+    def remove(self, asset_id: str):
+        if asset_id in self.assets:
+            author, owner = self.assets.pop(asset_id)
+            self.authors[author].discard(asset_id)
+            self.owners[owner].discard(asset_id)
+            
+    def owned_by(self, user_id: int) -> List[str]:
+        return sorted(self.owners.get(user_id, ()))
+    
+    def created_by(self, user_id: int) -> List[str]:
+        return sorted(self.authors.get(user_id, ()))
+    
+
 class UniBit(commands.Cog):
     """Système global de certificats digitaux"""
 
@@ -121,17 +174,102 @@ class UniBit(commands.Cog):
         self.config = Config.get_conf(self, identifier=736144321857978388, force_registration=True)
 
         default_global = {
-            'Database' : {}
+            'Database' : {},
+            'Schema': 0
         }
 
         self.config.register_global(**default_global)
         
+        self.config.init_custom('Assets', 1)
+        self.config.register_custom('Assets', Entries={})
+        self.config.init_custom('History', 1)
+        self.config.register_custom('History', Events={})
+        
+        self.index = None
+        self.migrated = False
+        self.storage_lock = asyncio.Lock()
+        self.reserved_ids = set()
+        self.asset_locks = {}
+        
+    def _shard(self, asset_id: str):
+        """Renvoie le groupe contenant l'asset (les assets sont répartis selon les premiers caractères de leur ID)"""
+        return self.config.custom('Assets', asset_id[:ASSET_SHARD_PREFIX]).Entries
+    
+    async def migrate_database(self):
+        """Met à jour le stockage des assets si nécessaire
+        
+        Les assets encore stockés dans l'ancien dictionnaire global 'Database' sont répartis dans les groupes d'assets,
+        puis leurs historiques sont déplacés dans le journal des opérations et remplacés par un instantané"""
+        if self.migrated:
+            return
+        async with self.storage_lock:
+            if self.migrated:
+                return
+            if await self.config.Schema() < STORAGE_SCHEMA:
+                legacy = await self.config.Database()
+                if legacy:
+                    async with self.config.custom('Assets').all() as shards:
+                        for asset_id, data in legacy.items():
+                            shards.setdefault(asset_id[:ASSET_SHARD_PREFIX], {}).setdefault('Entries', {})[asset_id] = data
+                    await self.config.Database.clear()
+                    logger.info(f"Migration de {len(legacy)} assets vers le stockage réparti")
+                
+                shards = await self.config.custom('Assets').all()
+                histories = {asset_id: data['history'] for shard in shards.values()
+                             for asset_id, data in shard.get('Entries', {}).items() if 'history' in data}
+                if histories:
+                    async with self.config.custom('History').all() as tree:
+                        for asset_id, events in histories.items():
+                            tree[asset_id] = {'Events': {str(n): e for n, e in enumerate(events)}}
+                    async with self.config.custom('Assets').all() as shards:
+                        for shard in shards.values():
+                            for asset_id, data in shard.get('Entries', {}).items():
+                                if asset_id in histories:
+                                    data['snapshot'] = history_snapshot(data.pop('history'))
+                    logger.info(f"Migration de l'historique de {len(histories)} assets vers le journal des opérations")
+                await self.config.Schema.set(STORAGE_SCHEMA)
+            self.migrated = True
+            
+    async def get_raw_asset(self, asset_id: str) -> dict:
+        await self.migrate_database()
+        return await self._shard(asset_id).get_raw(asset_id, default=None)
+    
+    async def set_raw_asset(self, asset_id: str, data: dict):
+        await self.migrate_database()
+        await self._shard(asset_id).set_raw(asset_id, value=data)
+        
+    async def clear_raw_asset(self, asset_id: str):
+        await self.migrate_database()
+        await self._shard(asset_id).clear_raw(asset_id)
+        
+    async def all_raw_assets(self) -> dict:
+        """Renvoie les données brutes de tous les assets (ID -> données)"""
+        await self.migrate_database()
+        shards = await self.config.custom('Assets').all()
+        return {asset_id: data for shard in shards.values() for asset_id, data in shard.get('Entries', {}).items()}
+        
+    async def get_index(self) -> AssetIndex:
+        """Renvoie l'index des assets par propriétaire et par auteur, construit au premier appel"""
+        if self.index is None:
+            assets = await self.all_raw_assets()
+            index = AssetIndex()
+            for asset_id, data in assets.items():
+                index.add(asset_id, data['metadata']['author'], data['snapshot']['owner'])
+            self.index = index
+        return self.index
+        
     async def generate_uid(self):
-        assets = await self.config.Database()
-        uid = ''.join(random.choices(string.ascii_lowercase + string.digits, k=8))
-        while uid in assets:
-            uid = ''.join(random.choices(string.ascii_lowercase + string.digits, k=8))
-        return uid
+        """Génère un ID d'asset inutilisé, réservé jusqu'à l'enregistrement de l'asset
+        
+        Seul le groupe correspondant au préfixe de l'ID est consulté"""
+        while True:
+            uid = ''.join(random.choices(string.ascii_lowercase + string.digits, k=ASSET_ID_LENGTH))
+            if uid in self.reserved_ids:
+                continue
+            self.reserved_ids.add(uid)
+            if await self.get_raw_asset(uid) is None:
+                return uid
+            self.reserved_ids.discard(uid)
         
     async def create_asset(self, author: discord.User, item, **extension) -> Asset:
         """Créer un asset global"""
@@ -140,12 +278,17 @@ class UniBit(commands.Cog):
             'metadata': {
                 'author': author.id,
                 'created_at': time.time()},
-            'history': [{'timestamp': time.time(), 'event': f"Création par {author}", 'owner': author.id}],
+            'snapshot': {'owner': author.id, 'transfers': 0, 'seq': 1},
             'item': item
         }
         asset_data.update(extension)
         
-        await self.config.Database.set_raw(asset_id, value=asset_data)
+        try:
+            await self.config.custom('History', asset_id).Events.set_raw('0', value={'timestamp': time.time(), 'event': f"Création par {author}", 'owner': author.id})
+            await self.set_raw_asset(asset_id, asset_data)
+        finally:
+            self.reserved_ids.discard(asset_id)
+        (await self.get_index()).add(asset_id, author.id, author.id)
         return Asset(self, asset_id, asset_data)
     
     async def edit_asset(self, asset: Asset, **update) -> Asset:
@@ -153,55 +296,82 @@ class UniBit(commands.Cog):
         new_data = asset._raw
         new_data.update(update)
         
-        await self.config.Database.set_raw(asset.id, value=new_data)
+        await self.set_raw_asset(asset.id, new_data)
+        if 'snapshot' in update:
+            (await self.get_index()).move(asset.id, new_data['snapshot']['owner'])
         return Asset(self, asset.id, new_data)
     
     async def delete_asset(self, asset: Asset):
         """Supprimer un asset global"""
-        assets = await self.config.Database()
-        if asset.id not in assets:
+        if asset.id not in (await self.get_index()).assets:
             raise KeyError(f"L'asset {asset.id} n'existe pas")
         
-        await self.config.Database.clear_raw(asset.id)  
+        await self.clear_raw_asset(asset.id)
+        await self.config.custom('History', asset.id).clear()
+        self.index.remove(asset.id)
+    
+    async def get_asset_history(self, asset: Asset) -> List[dict]:
+        """Renvoie l'historique complet des opérations de l'asset, de la plus ancienne à la plus récente"""
+        await self.migrate_database()
+        events = await self.config.custom('History', asset.id).Events()
+        return [events[n] for n in sorted(events, key=int)]
+    
+    async def _save_snapshot(self, asset: Asset, snapshot: dict) -> Asset:
+        await self._shard(asset.id).set_raw(asset.id, 'snapshot', value=snapshot)
+        (await self.get_index()).move(asset.id, snapshot['owner'])
+        asset._raw['snapshot'] = snapshot
+        return Asset(self, asset.id, asset._raw)
     
     async def append_asset_event(self, asset: Asset, event: str, owner: discord.User, **attachments) -> Asset:
-        """Ajouter une opération à l'asset"""
+        """Ajouter une opération à l'asset
+        
+        L'opération est ajoutée au journal sans réécrire les précédentes, et l'instantané de l'asset est mis à jour"""
         ope = {'timestamp': time.time(), 'event': event, 'owner': owner.id}
         ope.update(attachments)
         
-        new_history = copy(asset.history)
-        new_history.append(ope)
-        
-        return await self.edit_asset(asset, history=new_history)  
+        await self.migrate_database()
+        async with self.asset_locks.setdefault(asset.id, asyncio.Lock()):
+            snapshot = await self._shard(asset.id).get_raw(asset.id, 'snapshot')
+            await self.config.custom('History', asset.id).Events.set_raw(str(snapshot['seq']), value=ope)
+            if owner.id != snapshot['owner']:
+                snapshot['transfers'] += 1
+            snapshot.update(owner=owner.id, seq=snapshot['seq'] + 1)
+            return await self._save_snapshot(asset, snapshot)
     
     async def remove_asset_event(self, asset: Asset, index: int) -> Asset:
         """Retirer une opération à l'asset"""
-        if len(asset.history) <= index:
-            raise ValueError(f"Impossible de retirer un log sur ID:{asset.id} à l'index {index}")
-        
-        new_history = copy(asset.history)
-        new_history.remove(asset.history[index])
-        
-        return await self.edit_asset(asset, history=new_history)
+        await self.migrate_database()
+        async with self.asset_locks.setdefault(asset.id, asyncio.Lock()):
+            events = await self.config.custom('History', asset.id).Events()
+            keys = sorted(events, key=int)
+            if len(keys) <= index:
+                raise ValueError(f"Impossible de retirer un log sur ID:{asset.id} à l'index {index}")
+            
+            await self.config.custom('History', asset.id).Events.clear_raw(keys[index])
+            del keys[index]
+            seq = await self._shard(asset.id).get_raw(asset.id, 'snapshot', 'seq')
+            return await self._save_snapshot(asset, history_snapshot([events[k] for k in keys], seq))
     
     
     async def get_asset(self, asset_id: str) -> Asset:
         """Obtenir les données d'un asset"""
-        assets = await self.list_assets()
-        for a in assets:
-            if a.id == asset_id:
-                return a
-        return None
+        data = await self.get_raw_asset(asset_id)
+        return Asset(self, asset_id, data) if data else None
     
     async def list_assets(self) -> List[Asset]:
         """Liste tous les assets existants"""
-        assets = await self.config.Database()
+        assets = await self.all_raw_assets()
         return [Asset(self, a, assets[a]) for a in assets]
     
     async def user_assets(self, user: discord.User) -> List[Asset]:
         """Obtenir tous les assets d'un utilisateur"""
-        all_assets = await self.list_assets()
-        return [asset for asset in all_assets if asset.owner == user]
+        index = await self.get_index()
+        return [a for a in [await self.get_asset(i) for i in index.owned_by(user.id)] if a]
+    
+    async def author_assets(self, user: discord.User) -> List[Asset]:
+        """Obtenir tous les assets créés par un utilisateur"""
+        index = await self.get_index()
+        return [a for a in [await self.get_asset(i) for i in index.created_by(user.id)] if a]
         
     async def transfer_asset(self, asset: Asset, new_owner: discord.User, **attachments):
         """Transférer un asset de son possesseur actuel à un nouveau propriétaire"""
@@ -236,6 +406,7 @@ class UniBit(commands.Cog):
         
         em.add_field(name="Propriétaire actuel", value=f"ID:{asset.owner}" if type(asset.owner) not in (discord.User, discord.Member) else f'{asset.owner}')
         
+        em.add_field(name="Transferts", value=str(asset.transfers))
         em.add_field(name="Type d'objet", value=asset.item.item_type_name())
         em.add_field(name="Contenu", value=asset.item.one_liner_repr(), inline=False)
         
@@ -253,7 +424,7 @@ class UniBit(commands.Cog):
         embeds = []
         tabl = []
         
-        for event in asset.history:
+        for event in await self.get_asset_history(asset):
             if len(tabl) < 25:
                 date = datetime.now().fromtimestamp(event['timestamp']).strftime('%d.%m.%Y %H:%M')
                 owner = self.bot.get_user(event['owner'])
@@ -319,6 +490,41 @@ class UniBit(commands.Cog):
         
         await menu(ctx, embeds, DEFAULT_CONTROLS)
         
+    @manage_unibit.command(name='created', aliases=['crees'])
+    async def show_author_assets(self, ctx, user: discord.User = None):
+        """Affiche une liste des Assets créés, avec leur propriétaire actuel
+        
+        Mentionner un membre permet de consulter les Assets dont il est l'auteur"""
+        user = ctx.author if not user else user
+        assets = await self.author_assets(user)
+        cross = self.bot.get_emoji(812451214179434551)
+        
+        if not assets:
+            return await ctx.reply(f"{cross} **Aucune création** · Cet utilisateur n'est l'auteur d'aucun asset", mention_author=False)
+        
+        embeds = []
+        tabl = []
+        
+        for asset in assets:
+            if len(tabl) == 25:
+                em = discord.Embed(color=await ctx.embed_color())
+                em.set_author(name="Assets créés", icon_url=user.avatar_url)
+                em.description = box(tabulate(tabl, headers=('ID Asset', 'Objet', 'Propriétaire')))
+                em.set_footer(text="Consultez un Asset avec ;asset info <id>")
+                embeds.append(em)
+                tabl = []
+            owner = asset.owner if type(asset.owner) in (discord.User, discord.Member) else f"ID:{asset.owner}"
+            tabl.append((asset.id, asset.item.item_type_name(), owner))
+        
+        if tabl:
+            em = discord.Embed(color=await ctx.embed_color())
+            em.set_author(name="Assets créés", icon_url=user.avatar_url)
+            em.description = box(tabulate(tabl, headers=('ID Asset', 'Objet', 'Propriétaire')))
+            em.set_footer(text="Consultez un Asset avec ;asset info <id>")
+            embeds.append(em)
+        
+        await menu(ctx, embeds, DEFAULT_CONTROLS)
+        
     @manage_unibit.command(name='give')
     async def give_asset(self, ctx, to: discord.User, asset_id: str):
         """Donner un Asset au membre visé"""
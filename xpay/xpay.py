@@ -1,4 +1,6 @@
 import asyncio
+import bisect
+import json
 import logging
 from numbers import Rational
 import random
@@ -6,9 +8,10 @@ import re
 import string
 import time
 import uuid
+from contextlib import AsyncExitStack
 from copy import copy
 from datetime import datetime, timedelta
-from typing import Generator, List, Literal, Union
+from typing import Generator, List, Literal, Optional, Union
 import statistics
 
 import discord
@@ -18,6 +21,7 @@ from discord.ext.commands.converter import MemberConverter
 from discord.member import Member
 from redbot.core import Config, checks, commands
 from redbot.core.config import Value
+from redbot.core.data_manager import cog_data_path
 from redbot.core.utils import AsyncIter
 from redbot.core.utils.chat_formatting import box, humanize_number, humanize_timedelta
 from redbot.core.utils.menus import (DEFAULT_CONTROLS, menu,
@@ -27,6 +31,34 @@ from tabulate import tabulate
 logger = logging.getLogger("red.RedX.XPay")
 
 LOGS_EXPIRATION = 604800 # 7 jours
+LOGS_SEGMENT = 86400 # 1 jour
+TRANSFER_CHUNK_SIZE = 500 # Nb. d'enregistrements par écriture lors d'un import
+
+async def commit_members(config: Config, guild_id: int, updates: dict):
+    """Écrit les modifications de plusieurs comptes d'un serveur de *config*, en parallèle et avec l'API publique de Config
+    
+    *updates* associe l'ID de chaque membre à un dict des valeurs à modifier (les sous-dicts sont fusionnés avec l'existant)"""
+    writes = []
+    for uid, values in updates.items():
+        member = config.member_from_ids(guild_id, uid)
+        for key, value in values.items():
+            if isinstance(value, dict):
+                writes.extend([member.set_raw(key, subkey, value=subvalue) for subkey, subvalue in value.items()])
+            else:
+                writes.append(member.set_raw(key, value=value))
+    await asyncio.gather(*writes)
+
+
+def differs(current: dict, new: dict) -> bool:
+    """Indique si les valeurs de *new* (sous-dicts compris) diffèrent de celles de *current*"""
+    for key, value in new.items():
+        if isinstance(value, dict):
+            if differs(current.get(key) or {}, value):
+                return True
+        elif current.get(key) != value:
+            return True
+    return False
+
 
 MEDALS = {
     1: '🥇',
@@ -36,17 +68,15 @@ MEDALS = {
 
 
 class Account:
+    """Vue sur les données brutes du compte d'un membre"""
+    __slots__ = ('member', '_raw')
+    
     def __init__(self, member: discord.Member, data: dict):
         self.member = member
-        
-        self.balance = data['Balance']
-        self.logs = data['Logs']
-        self.config = data['Config']
-        
-        self.__dict__.update(data)
+        self._raw = data
 
     def __str__(self):
-        return self.member
+        return str(self.member)
     
     def __int__(self):
         return self.balance
@@ -54,41 +84,316 @@ class Account:
     def __eq__(self, other: object):
         return self.member.id == other.member.id
     
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        try:
+            return self._raw[attr]
+        except KeyError:
+            raise AttributeError(attr)
+    
+    @property
+    def balance(self) -> int:
+        return self._raw['Balance']
+    
+    @property
+    def logs(self) -> list:
+        return self._raw.get('Logs', [])
+    
+    @property
+    def config(self) -> dict:
+        return self._raw['Config']
+    
     def humanize_balance(self):
         return humanize_number(self.balance)
 
 
 class Transaction:
-    def __init__(self, member: discord.Member, data):
+    """Vue sur les données brutes d'une transaction, les attributs absents valent None"""
+    __slots__ = ('member', '_raw')
+    
+    def __init__(self, member: discord.Member, data: dict):
         self.member = member
         self._raw = data
-        
-        self.delta = data['delta']
-        self.timestamp = data['timestamp']
-        
-        self.__dict__.update(data)
 
     def __str__(self):
         return self.id
     
     def __getattr__(self, attr):
-        return None
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        return self._raw.get(attr)
+    
+    @property
+    def delta(self) -> int:
+        return self._raw['delta']
+    
+    @property
+    def timestamp(self) -> float:
+        return self._raw['timestamp']
     
     @property
     def id(self):
-        return f'{str(int(self.timestamp * 100))}{self.delta:+}'
+        """Identifiant formé du timestamp et de la variation, suivi du numéro de séquence s'il a fallu en attribuer un"""
+        base = f'{str(int(self.timestamp * 100))}{self.delta:+}'
+        return f'{base}.{self._raw["seq"]}' if self._raw.get('seq') else base
+    
+    @staticmethod
+    def sequence(current: List[dict], new: List[dict]):
+        """Numérote les nouvelles transactions dont l'identifiant est déjà pris dans le segment *current*
+        
+        Les transactions d'un même lot partageant le même timestamp, deux variations identiques auraient sinon le même identifiant"""
+        taken = {Transaction(None, l).id for l in current}
+        for log in new:
+            log.pop('seq', None)
+            n = 0
+            while Transaction(None, log).id in taken:
+                n += 1
+                log['seq'] = n
+            taken.add(Transaction(None, log).id)
     
     @property
     def description(self):
-        poss_desc = [k for k in self.__dict__ if k in ('description', 'desc', 'reason')]
-        if poss_desc:
-            return self._raw[poss_desc[0]] if self._raw[poss_desc[0]] else '...'
+        for key in ('description', 'desc', 'reason'):
+            if key in self._raw:
+                return self._raw[key] if self._raw[key] else '...'
         return '...'
     
     def ftimestamp(self, fmt: str = '%d/%m/%Y %H:%M'):
         return datetime.now().fromtimestamp(self.timestamp).strftime(fmt)
     
 
+class BalanceIndex:
+    """Classement trié des soldes d'un serveur, maintenu par bissection"""
+    def __init__(self, balances: dict = None):
+        self._balances = dict(balances) if balances else {}
+        self._sorted = sorted((-b, uid) for uid, b in self._balances.items())
+        
+    def __len__(self):
+        return len(self._sorted)
+    
+    def __contains__(self, member_id: int):
+        return member_id in self._balances
+    
+    def update(self, member_id: int, balance: int):
+        self.remove(member_id)
+        self._balances[member_id] = balance
+        bisect.insort(self._sorted, (-balance, member_id))
+        
+    def remove(self, member_id: int):
+        if member_id not in self._balances:
+            return
+        key = (-self._balances.pop(member_id), member_id)
+        i = bisect.bisect_left(self._sorted, key)
+        if i < len(self._sorted) and self._sorted[i] == key:
+            del self._sorted[i]
+            
+    def rank(self, member_id: int) -> int:
+        """Renvoie la position (à partir de 1) du membre, ou None s'il n'est pas classé"""
+        if member_id not in self._balances:
+            return None
+        return bisect.bisect_left(self._sorted, (-self._balances[member_id], member_id)) + 1
+    
+    def top(self, n: int = None) -> List[tuple]:
+        """Renvoie les couples (ID membre, solde) des *n* premiers du classement"""
+        return [(uid, -b) for b, uid in self._sorted[:n]]
+    
+    
+class GuildStats:
+    """Agrégats des soldes d'un serveur, mis à jour à chaque modification de solde
+    
+    Les statistiques (hors total) ne portent que sur les soldes positifs"""
+    def __init__(self, balances: dict = None):
+        self._balances = dict(balances) if balances else {}
+        self._positive = sorted(b for b in self._balances.values() if b > 0)
+        self.total = sum(self._balances.values())
+        self.sum = sum(self._positive)
+        self.sumsq = sum(b * b for b in self._positive)
+        self._gini = None
+        
+    @property
+    def count(self) -> int:
+        return len(self._positive)
+    
+    def update(self, member_id: int, balance: int):
+        self.remove(member_id)
+        self._balances[member_id] = balance
+        self.total += balance
+        if balance > 0:
+            bisect.insort(self._positive, balance)
+            self.sum += balance
+            self.sumsq += balance * balance
+        self._gini = None
+            
+    def remove(self, member_id: int):
+        if member_id not in self._balances:
+            return
+        balance = self._balances.pop(member_id)
+        self.total -= balance
+        if balance > 0:
+            del self._positive[bisect.bisect_left(self._positive, balance)]
+            self.sum -= balance
+            self.sumsq -= balance * balance
+        self._gini = None
+        
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0
+    
+    def stdev(self) -> float:
+        """Écart type (d'échantillon) des soldes positifs"""
+        if self.count < 2:
+            return 0
+        return ((self.sumsq - self.sum * self.sum / self.count) / (self.count - 1)) ** 0.5
+    
+    def percentile(self, p: float) -> float:
+        """Renvoie le percentile *p* (entre 0 et 100) des soldes positifs"""
+        if not self._positive:
+            return 0
+        k = (len(self._positive) - 1) * p / 100
+        f = int(k)
+        c = min(f + 1, len(self._positive) - 1)
+        return self._positive[f] + (self._positive[c] - self._positive[f]) * (k - f)
+    
+    def median(self) -> float:
+        return self.percentile(50)
+    
+    def gini(self) -> float:
+        """Coefficient de Gini des soldes positifs, recalculé seulement après une modification"""
+        if self._gini is None:
+            n = self.count
+            if not n:
+                self._gini = 0
+            else:
+                weighted = sum(i * b for i, b in enumerate(self._positive, 1))
+                self._gini = (2 * weighted) / (n * self.sum) - (n + 1) / n
+        return self._gini
+    
+
+class TransactionIndex:
+    """Index inversé des transactions d'un serveur, par termes de description et par montant"""
+    def __init__(self):
+        self._logs = {}     # (ID membre, ID transaction) -> données brutes
+        self._terms = {}    # terme -> clés des transactions
+        self._sorted_terms = []
+        self._deltas = {}   # montant -> clés des transactions
+        self._members = {}  # ID membre -> clés des transactions
+        
+    def __len__(self):
+        return len(self._logs)
+    
+    @staticmethod
+    def tokenize(text: str) -> set:
+        return set(re.findall(r'\w+', text.lower()))
+        
+    def add(self, member_id: int, raw: dict):
+        log = Transaction(None, raw)
+        key = (member_id, log.id)
+        if key in self._logs:
+            return
+        self._logs[key] = raw
+        self._members.setdefault(member_id, set()).add(key)
+        self._deltas.setdefault(log.delta, set()).add(key)
+        for term in self.tokenize(log.description):
+            if term not in self._terms:
+                self._terms[term] = set()
+                bisect.insort(self._sorted_terms, term)
+            self._terms[term].add(key)
+            
+    def remove(self, member_id: int, raw: dict):
+        log = Transaction(None, raw)
+        key = (member_id, log.id)
+        if self._logs.pop(key, None) is None:
+            return
+        self._members[member_id].discard(key)
+        self._deltas[log.delta].discard(key)
+        for term in self.tokenize(log.description):
+            self._terms[term].discard(key)
+            if not self._terms[term]:
+                del self._terms[term]
+                del self._sorted_terms[bisect.bisect_left(self._sorted_terms, term)]
+                
+    def remove_member(self, member_id: int):
+        for key in list(self._members.get(member_id, [])):
+            self.remove(member_id, self._logs[key])
+            
+    def prune(self, before: float):
+        """Retire de l'index les transactions antérieures au timestamp *before*"""
+        for key, raw in list(self._logs.items()):
+            if raw['timestamp'] < before:
+                self.remove(key[0], raw)
+                
+    def _match_prefix(self, prefix: str) -> set:
+        keys = set()
+        i = bisect.bisect_left(self._sorted_terms, prefix)
+        while i < len(self._sorted_terms) and self._sorted_terms[i].startswith(prefix):
+            keys |= self._terms[self._sorted_terms[i]]
+            i += 1
+        return keys
+                
+    def search(self, text: List[str] = None, delta: int = None, member_id: int = None) -> List[tuple]:
+        """Renvoie les couples (ID membre, données brutes) correspondant à la recherche, des plus pertinents aux moins pertinents
+        
+        Chaque terme est cherché comme préfixe des mots des descriptions, le montant doit correspondre exactement"""
+        scores = {}
+        for term in self.tokenize(' '.join(text or [])):
+            for key in self._match_prefix(term):
+                scores[key] = scores.get(key, 0) + 1
+        if delta is not None:
+            for key in self._deltas.get(delta, []):
+                scores[key] = scores.get(key, 0) + 2
+        if member_id is not None:
+            allowed = self._members.get(member_id, set())
+            scores = {k: v for k, v in scores.items() if k in allowed}
+        ranked = sorted(scores, key=lambda k: (scores[k], self._logs[k]['timestamp']), reverse=True)
+        return [(k[0], self._logs[k]) for k in ranked]
+    
+
+class BalanceHistory:
+    """Sommes cumulées des variations de solde d'un membre, indexées par timestamp"""
+    def __init__(self, logs: List[dict] = None):
+        self._timestamps = []
+        self._cumsum = []
+        self._base = 0 # Somme des variations retirées par prune()
+        for log in sorted(logs or [], key=lambda l: l['timestamp']):
+            self.add(log['timestamp'], log['delta'])
+            
+    def __len__(self):
+        return len(self._timestamps)
+    
+    @property
+    def total(self) -> int:
+        return self._cumsum[-1] if self._cumsum else self._base
+            
+    def add(self, timestamp: float, delta: int):
+        if not self._timestamps or timestamp >= self._timestamps[-1]:
+            self._timestamps.append(timestamp)
+            self._cumsum.append(self.total + delta)
+        else:
+            i = bisect.bisect_right(self._timestamps, timestamp)
+            self._timestamps.insert(i, timestamp)
+            self._cumsum.insert(i, (self._cumsum[i - 1] if i else self._base) + delta)
+            for j in range(i + 1, len(self._cumsum)):
+                self._cumsum[j] += delta
+                
+    def prefix(self, timestamp: float) -> int:
+        """Somme des variations jusqu'au timestamp (inclus)"""
+        i = bisect.bisect_right(self._timestamps, timestamp)
+        return self._cumsum[i - 1] if i else self._base
+    
+    def variation(self, start: float, end: float) -> int:
+        """Somme des variations entre les deux timestamps (inclus)"""
+        i = bisect.bisect_left(self._timestamps, start)
+        return self.prefix(end) - (self._cumsum[i - 1] if i else self._base)
+    
+    def prune(self, before: float):
+        """Retire les variations antérieures au timestamp *before* sans changer les sommes suivantes"""
+        i = bisect.bisect_left(self._timestamps, before)
+        if i:
+            self._base = self._cumsum[i - 1]
+            del self._timestamps[:i]
+            del self._cumsum[:i]
+    
+
 class XPay(commands.Cog):
     """Système d'économie virtuelle"""
 
@@ -114,7 +419,8 @@ class XPay(commands.Cog):
                 'BaseLimit': 100000,
                 'Booster': 50,
                 'LowBalance': 50,
-                'LowBalanceLimit': 1000},
+                'LowBalanceLimit': 1000,
+                'Auto': False},
             'Giftcodes': {},
             'Settings': {
                 'FreeTransfersPerWeek': 3,
@@ -124,210 +430,836 @@ class XPay(commands.Cog):
         self.config.register_member(**default_member)
         self.config.register_guild(**default_guild)
         
+        # Transactions : Serveur > Membre > Segment journalier
+        self.config.init_custom('Transactions', 3)
+        self.config.register_custom('Transactions', Entries=[])
+        
+        self.leaderboards = {}
+        self.stats = {}
+        self.search_indexes = {}
+        self.histories = {}
+        self.log_segments = {} # Segment -> {(ID serveur, ID membre)} ayant des transactions enregistrées dans ce segment
+        self.log_segments_loaded = False
+        self.guild_locks = {}
+        
+        # Soldes en mémoire, enregistrés régulièrement par xpay_flush_loop
+        self.balances = {}
+        self.dirty = {}
+        self.account_locks = {}
+        
+        self.income_days = {}
+        
+        # Codes cadeaux en mémoire, enregistrés avec les soldes
+        self.giftcodes = {}
+        self.giftcode_locks = {}
+        self.dirty_giftcodes = set()
+        
+        self.xpay_logs_loop.start()
+        self.xpay_flush_loop.start()
+        self.xpay_income_loop.start()
+        
+    def cog_unload(self):
+        self.xpay_logs_loop.cancel()
+        self.xpay_income_loop.cancel()
+        # Le dernier enregistrement est attendu par after_xpay_flush_loop
+        self.xpay_flush_loop.cancel()
+        
+        
+# LOOP >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>><
+
+    @tasks.loop(hours=1.0)
+    async def xpay_logs_loop(self):
+        cutoff = self.log_segment(time.time() - LOGS_EXPIRATION)
+        for seg in [s for s in self.log_segments if s < cutoff]:
+            for guild_id, user_id in self.log_segments.pop(seg):
+                await self.config.custom('Transactions', str(guild_id), str(user_id), str(seg)).clear()
+        for index in self.search_indexes.values():
+            index.prune(time.time() - LOGS_EXPIRATION)
+        for guild_histories in self.histories.values():
+            for history in guild_histories.values():
+                history.prune(time.time() - LOGS_EXPIRATION)
+        for guild_id in self.giftcodes:
+            self.prune_giftcodes(guild_id)
+
+    @xpay_logs_loop.before_loop
+    async def before_xpay_logs_loop(self):
+        logger.info('Lancement de xpay_logs_loop...')
+        await self.bot.wait_until_ready()
+        await self.migrate_legacy_logs()
+        await self.load_log_segments()
+        
+    @tasks.loop(seconds=30.0)
+    async def xpay_flush_loop(self):
+        await self.flush_balances()
+        await self.flush_giftcodes()
+
+    @xpay_flush_loop.before_loop
+    async def before_xpay_flush_loop(self):
+        logger.info('Lancement de xpay_flush_loop...')
+        await self.bot.wait_until_ready()
+        
+    @xpay_flush_loop.after_loop
+    async def after_xpay_flush_loop(self):
+        """Enregistre une dernière fois les soldes et codes cadeaux en mémoire lorsque la boucle s'arrête (déchargement du module)"""
+        for flush in (self.flush_balances, self.flush_giftcodes):
+            try:
+                await flush()
+            except Exception as e:
+                logger.error(e, exc_info=True)
+        
+    @tasks.loop(minutes=5.0)
+    async def xpay_income_loop(self):
+        today = datetime.now().strftime("%Y%m%d")
+        all_guilds = await self.config.all_guilds()
+        for g in all_guilds:
+            if all_guilds[g]['Income'].get('Auto') and self.income_days.get(g) != today:
+                guild = self.bot.get_guild(g)
+                if guild:
+                    n = await self.distribute_daily_income(guild)
+                    logger.info(f"Aides journalières distribuées automatiquement à {n} membres de {guild.name}")
+                self.income_days[g] = today
+
+    @xpay_income_loop.before_loop
+    async def before_xpay_income_loop(self):
+        logger.info('Lancement de xpay_income_loop...')
+        await self.bot.wait_until_ready()
+        
         
 # META >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>><
     
-    async def migrate_from_alteco(self):
-        """Tente l'importation des données depuis l'ancien module économique AltEco"""
+    async def migrate_from_alteco(self, *, dry_run: bool = False, progress = None) -> dict:
+        """Importe les soldes et paramètres depuis l'ancien module économique AltEco
+        
+        Voir *migration_pipeline* pour le détail des paramètres et du rapport renvoyé"""
+        alteco_conf = Config.get_conf(None, identifier=736144321857978388, cog_name="AltEco")
+        
+        def guild_mapper(old: dict):
+            settings = {}
+            if 'Currency' in old:
+                settings['Currency'] = old['Currency']['string']
+            if 'DailyBonus' in old:
+                settings['Income'] = {'Base': old['DailyBonus']['base']}
+            return settings
+        
+        def member_mapper(old: dict):
+            return {'Balance': old['balance']} if 'balance' in old else None
+        
         try:
-            alteco_conf = Config.get_conf(None, identifier=736144321857978388, cog_name="AltEco")
-            guilds = self.bot.guilds
-            n = 1
-            for guild in guilds:
-                logger.info(msg=f"{n} Importation des données AltEco de : {guild.name}")
-                old_data = await alteco_conf.guild(guild).all()
-                await self.config.guild(guild).Currency.set(old_data['Currency']['string'])
-                await self.config.guild(guild).Income.set_raw('Base', value=old_data['DailyBonus']['base'])
-
-                for member in guild.members:
-                    user_old = await alteco_conf.member(member).all()
-                    await self.config.member(member).Balance.set(user_old['balance'])
-                n += 1
+            return await self.migration_pipeline(alteco_conf, guild_mapper, member_mapper, dry_run=dry_run, progress=progress)
         except Exception as e:
             logger.error(e, exc_info=True)
             raise
-        return True
+        
+    async def migration_pipeline(self, source: Config, guild_mapper, member_mapper, *, target: Config = None, balance_key: str = 'Balance',
+                                 dry_run: bool = False, progress = None, on_guild = None) -> dict:
+        """Importe les données d'un module économique vers un autre sur tous les serveurs du bot
+        
+        Les données source et cible (*target*, par défaut celles de XPay) sont lues en une fois, *guild_mapper* et *member_mapper* convertissent
+        les données brutes de chaque serveur et membre (None pour ignorer), puis seuls les comptes modifiés sont écrits par lots de TRANSFER_CHUNK_SIZE membres.
+        Avec *dry_run*, rien n'est écrit. *progress* est une coroutine appelée avec (serveur, comptes écrits, total) après chaque lot,
+        *on_guild* une fonction appelée avec le serveur une fois ses données écrites (pour invalider les caches du module cible).
+        Ce pipeline est aussi utilisé par AltEco pour importer les données de Finance.
+        
+        Renvoie pour chaque ID de serveur le nombre de comptes source, de comptes modifiés et la différence totale de crédits (clé *balance_key*)"""
+        target = target or self.config
+        own = target is self.config
+        if own:
+            await self.flush_balances()
+        source_guilds = await source.all_guilds()
+        source_members = await source.all_members()
+        current_members = await target.all_members()
+        
+        report = {}
+        for guild in self.bot.guilds:
+            old_members = source_members.get(guild.id, {})
+            current = current_members.get(guild.id, {})
+            records = {}
+            for uid, old in old_members.items():
+                if not guild.get_member(uid):
+                    continue
+                new = member_mapper(old)
+                if new and differs(current.get(uid, {}), new):
+                    records[uid] = new
+            report[guild.id] = {
+                'accounts': len(old_members),
+                'changed': len(records),
+                'delta': sum([new.get(balance_key, 0) - current.get(uid, {}).get(balance_key, 0) for uid, new in records.items()])
+            }
+            if dry_run:
+                continue
+            
+            logger.info(f"Importation des données de {source.cog_name} vers {target.cog_name} : {guild.name}")
+            settings = guild_mapper(source_guilds[guild.id]) if guild.id in source_guilds else None
+            async with AsyncExitStack() as stack:
+                if own:
+                    await stack.enter_async_context(self.get_guild_lock(guild.id))
+                for key, value in (settings or {}).items():
+                    if isinstance(value, dict):
+                        for subkey, subvalue in value.items():
+                            await target.guild(guild).set_raw(key, subkey, value=subvalue)
+                    else:
+                        await target.guild(guild).set_raw(key, value=value)
+                
+                items = list(records.items())
+                for i in range(0, len(items), TRANSFER_CHUNK_SIZE):
+                    chunk = dict(items[i:i + TRANSFER_CHUNK_SIZE])
+                    await commit_members(target, guild.id, chunk)
+                    if own:
+                        self.drop_imported_balances(guild.id, chunk)
+                    if progress:
+                        await progress(guild, min(i + TRANSFER_CHUNK_SIZE, len(items)), len(items))
+                if own:
+                    self.reset_guild_cache(guild.id)
+                if on_guild:
+                    on_guild(guild)
+        return report
+    
+    async def migrate_legacy_logs(self):
+        """Déplace les logs encore stockés dans la liste 'Logs' des membres vers les segments de transactions"""
+        all_members = await self.config.all_members()
+        for guild_id, guild_data in all_members.items():
+            for user_id, data in guild_data.items():
+                if not data.get('Logs'):
+                    continue
+                segments = {}
+                for log in data['Logs']:
+                    segments.setdefault(self.log_segment(log['timestamp']), []).append(log)
+                for seg, entries in segments.items():
+                    async with self.config.custom('Transactions', str(guild_id), str(user_id), str(seg)).Entries() as logs:
+                        logs.extend(entries)
+                        logs.sort(key=lambda l: l['timestamp'])
+                    self.track_segment(guild_id, user_id, seg)
+                await self.config.member_from_ids(guild_id, user_id).clear_raw('Logs')
     
     
 # BANQUE -----------------------------------------------
 
+    async def load_log_segments(self):
+        """Relève au démarrage les segments de transactions enregistrés, tenus à jour ensuite à chaque écriture
+        
+        C'est la seule lecture complète des transactions : l'expiration ne supprime ensuite que les segments connus"""
+        if self.log_segments_loaded:
+            return
+        self.log_segments_loaded = True
+        all_logs = await self.config.custom('Transactions').all()
+        for g in all_logs:
+            for m in all_logs[g]:
+                for seg in all_logs[g][m]:
+                    self.track_segment(int(g), int(m), int(seg))
+    
     async def get_currency(self, guild: discord.Guild):
         return await self.config.guild(guild).Currency()
     
+    async def get_balance_index(self, guild: discord.Guild) -> BalanceIndex:
+        """Renvoie l'index trié des soldes du serveur, construit lors du premier appel puis mis à jour à chaque modification de solde"""
+        if guild.id not in self.leaderboards:
+            balances = await self.all_balances(guild)
+            self.leaderboards[guild.id] = BalanceIndex({uid: balances[uid] for uid in balances if guild.get_member(uid)})
+        return self.leaderboards[guild.id]
+    
     async def get_leaderboard(self, guild: discord.Guild, top_cutoff: int = None) -> List[Account]:
         """Renvoie le top des membres les plus riches du serveur (liste d'objets AltEcoAccount) des plus riches aux moins riches
 
         Renvoie une liste vide si aucun top n'est générable"""
-        users = await self.config.all_members(guild)
-        sorted_users = sorted(list(users.items()), key=lambda u: u[1]['Balance'], reverse=True)
+        index = await self.get_balance_index(guild)
         top = []
-        for uid, acc in sorted_users:
+        for uid, _ in index.top(top_cutoff):
             user = guild.get_member(uid)
             if user:
                 top.append(await self.get_account(user))
-        return top[:top_cutoff] if top_cutoff else top
+        return top
     
     async def get_leaderboard_member_rank(self, member: discord.Member) -> int:
         """Renvoie la position du membre dans le classement de son serveur
 
         Renvoie la dernière place du classement si le membre n'est pas trouvé"""
-        top = await self.get_leaderboard(member.guild)
-        for acc in top:
-            if acc.member == member:
-                return top.index(acc) + 1
-        return len(top)
+        index = await self.get_balance_index(member.guild)
+        rank = index.rank(member.id)
+        return rank if rank else len(index)
+
+    async def guild_stats(self, guild: discord.Guild) -> dict:
+        """Renvoie les statistiques économiques du serveur
+        
+        Les agrégats sont construits lors du premier appel puis mis à jour à chaque modification de solde"""
+        if guild.id not in self.stats:
+            self.stats[guild.id] = GuildStats(await self.all_balances(guild))
+        stats = self.stats[guild.id]
+        return {
+            'total': stats.total,
+            'accounts': stats.count,
+            'mean': stats.mean(),
+            'stdev': stats.stdev(),
+            'median': stats.median(),
+            'gini': stats.gini()
+        }
 
     async def guild_total_credits(self, guild: discord.Guild) -> int:
         """Renvoie la valeur totale des crédits en circulation sur le serveur visé"""
-        users = await self.config.all_members(guild)
-        return sum([users[u]['Balance'] for u in users])
+        return (await self.guild_stats(guild))['total']
     
     async def guild_average_balance(self, guild: discord.Guild) -> int:
-        usersraw = await self.config.all_members(guild)
-        return statistics.mean([usersraw[u]['Balance'] for u in usersraw if usersraw[u]['Balance'] > 0])
+        return (await self.guild_stats(guild))['mean']
     
     async def guild_balance_standard_deviation(self, guild: discord.Guild) -> int:
-        usersraw = await self.config.all_members(guild)
-        return statistics.stdev([usersraw[u]['Balance'] for u in usersraw if usersraw[u]['Balance'] > 0])
+        return (await self.guild_stats(guild))['stdev']
+    
+    def track_balance(self, guild_id: int, user_id: int, value: int = None):
+        """Répercute un nouveau solde sur le classement et les statistiques du serveur (retire le compte si *value* est None)"""
+        for indexes in (self.leaderboards, self.stats):
+            if guild_id in indexes:
+                if value is None:
+                    indexes[guild_id].remove(user_id)
+                else:
+                    indexes[guild_id].update(user_id, value)
         
     
 # COMPTE -----------------------------------------------
 
+    def get_account_lock(self, member: discord.Member) -> asyncio.Lock:
+        """Renvoie le verrou protégeant les modifications du solde du membre"""
+        return self.account_locks.setdefault((member.guild.id, member.id), asyncio.Lock())
+    
+    def get_guild_lock(self, guild_id: int) -> asyncio.Lock:
+        """Renvoie le verrou protégeant les écritures groupées sur les comptes du serveur (lots, enregistrements, importations)"""
+        return self.guild_locks.setdefault(guild_id, asyncio.Lock())
+
     async def get_account(self, member: discord.Member) -> Account:
         raw = await self.config.member(member).all()
+        raw['Balance'] = await self.get_balance(member)
         return Account(member, raw)
     
     async def get_balance(self, member: discord.Member) -> int:
-        return await self.config.member(member).Balance()
+        cache = self.balances.setdefault(member.guild.id, {})
+        if member.id not in cache:
+            balance = await self.config.member(member).Balance()
+            cache.setdefault(member.id, balance)
+        return cache[member.id]
+    
+    async def all_balances(self, guild: discord.Guild) -> dict:
+        """Renvoie les soldes de tous les membres du serveur, en tenant compte de ceux pas encore enregistrés"""
+        users = await self.config.all_members(guild)
+        balances = {uid: users[uid]['Balance'] for uid in users}
+        balances.update(self.balances.get(guild.id, {}))
+        return balances
     
     async def balance_variation(self, member: discord.Member, 
                                 relative_start: int = LOGS_EXPIRATION,
                                 relative_end: int = 0) -> int:
-        totaldelta = 0
-        start = time.time() - relative_start
-        end = time.time() - relative_end
-        
-        for log in await self.member_logs(member):
-            if start <= log.timestamp <= end:
-                totaldelta += log.delta
-                
-        return totaldelta
+        history = await self.get_balance_history(member)
+        return history.variation(time.time() - relative_start, time.time() - relative_end)
     
     async def check_balance(self, member: discord.Member, cost: int) -> bool:
         return await self.get_balance(member) >= cost
     
-    async def set_balance(self, member: discord.Member, value: int, **attachments) -> Transaction:
+    async def _set_balance(self, member: discord.Member, value: int, **attachments) -> Transaction:
         if value < 0:
             raise ValueError("La valeur du solde ne peut être négative")
         
         current = await self.get_balance(member)
-        await self.config.member(member).Balance.set(value)
+        self.balances[member.guild.id][member.id] = value
+        self.dirty.setdefault(member.guild.id, set()).add(member.id)
+        self.track_balance(member.guild.id, member.id, value)
         
         return await self.register_log(member, value - current, **attachments)
     
+    async def set_balance(self, member: discord.Member, value: int, **attachments) -> Transaction:
+        async with self.get_account_lock(member):
+            return await self._set_balance(member, value, **attachments)
+    
     async def deposit_credits(self, member: discord.Member, amount: int, **attachments) -> Transaction:
         if amount < 0:
             raise ValueError("Impossible d'ajouter une valeur négative au solde")
         
-        current = await self.get_balance(member)
-        return await self.set_balance(member, current + amount, **attachments)
+        async with self.get_account_lock(member):
+            current = await self.get_balance(member)
+            return await self._set_balance(member, current + amount, **attachments)
     
     async def withdraw_credits(self, member: discord.Member, amount: int, **attachments) -> Transaction:
         amount = abs(amount)
         
-        current = await self.get_balance(member)
-        return await self.set_balance(member, current - amount, **attachments)
+        async with self.get_account_lock(member):
+            current = await self.get_balance(member)
+            return await self._set_balance(member, current - amount, **attachments)
+    
+    async def apply_deltas(self, guild: discord.Guild, entries: List[tuple]) -> List[Transaction]:
+        """Applique en une seule opération une série de variations de solde sur des membres du serveur
+        
+        *entries* est une liste de tuples (membre, delta, attachments). Si un des soldes devait devenir négatif, aucune opération n'est effectuée"""
+        async with self.get_guild_lock(guild.id):
+            return await self._apply_deltas(guild, entries)
+        
+    async def _apply_deltas(self, guild: discord.Guild, entries: List[tuple]) -> List[Transaction]:
+        """Voir *apply_deltas*, le verrou du serveur doit être détenu"""
+        for member, _, _ in entries:
+            if member.guild.id != guild.id:
+                raise ValueError(f"{member} n'est pas membre de {guild.name}")
+        members = sorted({member for member, _, _ in entries}, key=lambda m: m.id)
+        
+        async with AsyncExitStack() as stack:
+            for member in members:
+                await stack.enter_async_context(self.get_account_lock(member))
+            
+            balances = {member.id: await self.get_balance(member) for member in members}
+            for member, delta, _ in entries:
+                balances[member.id] += delta
+                
+            insufficient = [uid for uid in balances if balances[uid] < 0]
+            if insufficient:
+                raise ValueError(f"La valeur du solde ne peut être négative ({', '.join(map(str, insufficient))})")
+            
+            self.balances.setdefault(guild.id, {}).update(balances)
+            self.dirty.setdefault(guild.id, set()).update(balances)
+            for uid in balances:
+                self.track_balance(guild.id, uid, balances[uid])
+            
+            now = time.time()
+            grouped = {}
+            for member, delta, attachments in entries:
+                log = {'delta': delta, 'timestamp': now}
+                log.update(attachments or {})
+                grouped.setdefault(member, []).append(log)
+
+            # Seul le segment du jour de chaque membre concerné est réécrit, les écritures étant faites en parallèle
+            segment = self.log_segment(now)
+            
+            async def write_logs(member: discord.Member, member_logs: List[dict]):
+                async with self._logs_group(member, segment)() as logs:
+                    Transaction.sequence(logs, member_logs)
+                    logs.extend(member_logs)
+                self.track_segment(guild.id, member.id, segment)
+            await asyncio.gather(*[write_logs(member, member_logs) for member, member_logs in grouped.items()])
+            
+            transactions = []
+            for member, member_logs in grouped.items():
+                self.track_logs(guild.id, member.id, member_logs)
+                transactions.extend([Transaction(member, l) for l in member_logs])
+        return transactions
+    
+    async def flush_balances(self):
+        """Enregistre les soldes modifiés en mémoire depuis le dernier enregistrement"""
+        for guild_id in list(self.dirty):
+            async with self.get_guild_lock(guild_id):
+                await self._flush_guild_balances(guild_id)
+                
+    async def _flush_guild_balances(self, guild_id: int):
+        """Enregistre les soldes modifiés d'un serveur, le verrou du serveur doit être détenu"""
+        dirty = self.dirty.pop(guild_id, set())
+        cache = self.balances.get(guild_id, {})
+        updates = {uid: {'Balance': cache[uid]} for uid in dirty if uid in cache}
+        if not updates:
+            return
+        try:
+            await commit_members(self.config, guild_id, updates)
+        except asyncio.CancelledError:
+            # Enregistrement interrompu par l'arrêt de la boucle : les soldes seront repris par after_xpay_flush_loop
+            self.dirty.setdefault(guild_id, set()).update(updates)
+            raise
+        except Exception as e:
+            self.dirty.setdefault(guild_id, set()).update(updates)
+            logger.error(e, exc_info=True)
+                
+    def reset_guild_cache(self, guild_id: int):
+        """Retire de la mémoire les données dérivées d'un serveur (classement, statistiques, index de recherche, historiques)
+        
+        Les soldes et codes cadeaux en attente d'enregistrement ne sont pas touchés"""
+        self.leaderboards.pop(guild_id, None)
+        self.stats.pop(guild_id, None)
+        self.search_indexes.pop(guild_id, None)
+        self.histories.pop(guild_id, None)
+                
+    def drop_cached_balances(self, guild_id: int, user_id: int = None):
+        """Retire de la mémoire les soldes d'un serveur (ou d'un seul membre) sans les enregistrer"""
+        if user_id is None:
+            self.balances.pop(guild_id, None)
+            self.dirty.pop(guild_id, None)
+        else:
+            self.balances.get(guild_id, {}).pop(user_id, None)
+            self.dirty.get(guild_id, set()).discard(user_id)
+            
+    def drop_imported_balances(self, guild_id: int, records: dict):
+        """Retire de la mémoire les soldes écrasés par une importation, les valeurs importées faisant foi
+        
+        Les autres soldes en attente d'enregistrement sont conservés"""
+        for uid, values in records.items():
+            if 'Balance' in values:
+                self.drop_cached_balances(guild_id, uid)
     
     async def rollback_credits(self, log: Transaction) -> Transaction:
         member = log.member
         if log.refund:
             raise ValueError(f"Impossible de rembourser un remboursement ({log.id})")
         amount = -log.delta
-        current = await self.get_balance(member)
-        return await self.set_balance(member, current + amount, reason=log.description, refund=log.id)
+        async with self.get_account_lock(member):
+            current = await self.get_balance(member)
+            return await self._set_balance(member, current + amount, reason=log.description, refund=log.id)
     
 
 # TRANSACTIONS -----------------------------------------
 
-    async def member_logs(self, member: discord.Member) -> List[Transaction]:
-        raw = await self.config.member(member).Logs()
+    def log_segment(self, timestamp: float) -> int:
+        """Renvoie le numéro du segment journalier contenant le timestamp"""
+        return int(timestamp // LOGS_SEGMENT)
+    
+    def _logs_group(self, member: discord.Member, segment: int):
+        return self.config.custom('Transactions', str(member.guild.id), str(member.id), str(segment)).Entries
+
+    async def member_raw_logs(self, member: discord.Member, start: float = None, end: float = None) -> List[dict]:
+        """Renvoie les données brutes des transactions du membre comprises entre les timestamps *start* et *end*
+
+        Par défaut, renvoie toutes les transactions non expirées. Seuls les segments couvrant la fenêtre demandée sont lus"""
+        now = time.time()
+        start = start if start is not None else now - LOGS_EXPIRATION
+        end = end if end is not None else now
         logs = []
-        for l in raw:
-            logs.append(Transaction(member, l))
+        for seg in range(self.log_segment(start), self.log_segment(end) + 1):
+            logs.extend([l for l in await self._logs_group(member, seg)() if start <= l['timestamp'] <= end])
         return logs
 
+    async def member_logs(self, member: discord.Member, start: float = None, end: float = None) -> List[Transaction]:
+        """Renvoie les transactions du membre comprises entre les timestamps *start* et *end*"""
+        return [Transaction(member, l) for l in await self.member_raw_logs(member, start, end)]
+
     async def get_log(self, member: discord.Member, id: str) -> Transaction:
-        for log in await self.member_logs(member):
-            if log.id == id:
-                return log
+        idts = re.match(r'^(\d+)[+-]\d+(\.\d+)?$', id)
+        if not idts:
+            return None
+        ts = int(idts.group(1)) / 100
+        for seg in {self.log_segment(ts), self.log_segment(ts + 0.01)}:
+            for l in await self._logs_group(member, seg)():
+                log = Transaction(member, l)
+                if log.id == id:
+                    return log
         return None
     
     async def register_log(self, member: discord.Member, delta: int, **attachments) -> Transaction:
         log = {'delta': delta, 'timestamp': time.time()}
         log.update(attachments)
-        async with self.config.member(member).Logs() as logs:
+        async with self._logs_group(member, self.log_segment(log['timestamp']))() as logs:
+            Transaction.sequence(logs, [log])
             logs.append(log)
+        self.track_segment(member.guild.id, member.id, self.log_segment(log['timestamp']))
+        self.track_logs(member.guild.id, member.id, [log])
         
         return Transaction(member, log)
     
     async def delete_log(self, member: discord.Member, log: Transaction):
-        async with self.config.member(member).logs() as logs:
+        async with self._logs_group(member, self.log_segment(log.timestamp))() as logs:
             try:
                 logs.remove(log._raw)
             except ValueError:
                 raise
+        if member.guild.id in self.search_indexes:
+            self.search_indexes[member.guild.id].remove(member.id, log._raw)
+        self.histories.get(member.guild.id, {}).pop(member.id, None)
+            
+    async def clear_logs(self, member: discord.Member) -> None:
+        """Supprime les segments de transactions expirés du membre"""
+        cutoff = self.log_segment(time.time() - LOGS_EXPIRATION)
+        segments = await self.config.custom('Transactions', str(member.guild.id), str(member.id)).all()
+        for seg in [s for s in segments if int(s) < cutoff]:
+            await self.config.custom('Transactions', str(member.guild.id), str(member.id), seg).clear()
             
-    async def clear_logs(self, member: discord.Member) -> dict:
-        clean = await self.config.member(member).Logs()
-        for log in await self.member_logs(member):
-            if log.timestamp + LOGS_EXPIRATION <= time.time():
-                clean.remove(log._raw)
+    def track_logs(self, guild_id: int, user_id: int, logs: List[dict]):
+        """Répercute de nouvelles transactions sur l'index de recherche et l'historique de solde du membre"""
+        if guild_id in self.search_indexes:
+            for l in logs:
+                self.search_indexes[guild_id].add(user_id, l)
+        history = self.histories.get(guild_id, {}).get(user_id)
+        if history is not None:
+            for l in logs:
+                history.add(l['timestamp'], l['delta'])
+                
+    def forget_logs(self, guild_id: int, user_id: int):
+        """Retire les transactions d'un membre de l'index de recherche, de son historique de solde et des segments connus"""
+        if guild_id in self.search_indexes:
+            self.search_indexes[guild_id].remove_member(user_id)
+        self.histories.get(guild_id, {}).pop(user_id, None)
+        self.forget_segments(guild_id, user_id)
+        
+    def track_segment(self, guild_id: int, user_id: int, segment: int):
+        """Retient qu'un membre a des transactions enregistrées dans le segment, pour leur expiration"""
+        self.log_segments.setdefault(segment, set()).add((guild_id, user_id))
+        
+    def forget_segments(self, guild_id: int, user_id: int = None):
+        """Oublie les segments d'un serveur (ou d'un seul membre) dont les transactions ont été supprimées"""
+        for members in self.log_segments.values():
+            members.difference_update({k for k in members if k[0] == guild_id and (user_id is None or k[1] == user_id)})
+            
+    async def get_balance_history(self, member: discord.Member) -> BalanceHistory:
+        """Renvoie les sommes cumulées des variations de solde du membre, construites lors du premier appel puis mises à jour à chaque transaction"""
+        histories = self.histories.setdefault(member.guild.id, {})
+        if member.id not in histories:
+            logs = await self.member_raw_logs(member)
+            histories.setdefault(member.id, BalanceHistory(logs))
+        return histories[member.id]
+    
+    async def get_search_index(self, guild: discord.Guild) -> TransactionIndex:
+        """Renvoie l'index de recherche des transactions du serveur, construit lors du premier appel puis mis à jour à chaque nouvelle transaction"""
+        if guild.id not in self.search_indexes:
+            index = TransactionIndex()
+            cutoff = time.time() - LOGS_EXPIRATION
+            all_logs = await self.config.custom('Transactions', str(guild.id)).all()
+            for m in all_logs:
+                for seg in all_logs[m].values():
+                    for l in seg.get('Entries', []):
+                        if l['timestamp'] >= cutoff:
+                            index.add(int(m), l)
+            self.search_indexes[guild.id] = index
+        return self.search_indexes[guild.id]
+    
+
+# AIDES ------------------------------------------------
+
+    def daily_income_details(self, income: dict, balance: int, booster: bool) -> List[tuple]:
+        """Renvoie le détail (montant, libellé) des aides journalières d'un membre selon les paramètres *income* du serveur"""
+        details = []
+        if income['BaseLimit'] and balance > income['BaseLimit']:
+            details.append((0, "Base d'aide journalière (Solde trop élevé)"))
+        else:
+            details.append((income['Base'], "Base d'aide journalière"))
         
-        await self.config.member(member).Logs.set(clean)
-        return clean
+        if booster:
+            details.append((income['Booster'], "Booster du serveur"))
+        
+        if balance < income['LowBalanceLimit']:
+            details.append((income['LowBalance'], "Majoration solde faible"))
+        return details
+    
+    async def distribute_daily_income(self, guild: discord.Guild) -> int:
+        """Verse en un seul lot les aides journalières de tous les membres du serveur ne les ayant pas encore récupérées
+        
+        Les soldes sont lus et crédités sous le verrou du serveur, comme pour *apply_deltas*. Renvoie le nombre de membres crédités"""
+        today = datetime.now().strftime("%Y%m%d")
+        async with self.get_guild_lock(guild.id):
+            income = await self.config.guild(guild).Income()
+            users = await self.config.all_members(guild)
+            cached = self.balances.get(guild.id, {})
+            
+            entries, days = [], {}
+            for uid, data in users.items():
+                member = guild.get_member(uid)
+                if not member or data['Config']['day'] == today:
+                    continue
+                balance = cached.get(uid, data['Balance'])
+                total = sum([amount for amount, _ in self.daily_income_details(income, balance, bool(member.premium_since))])
+                days[uid] = {'Config': {'day': today}}
+                if total:
+                    entries.append((member, total, {'desc': 'Aides journalières'}))
+                    
+            await commit_members(self.config, guild.id, days)
+            if entries:
+                await self._apply_deltas(guild, entries)
+        return len(entries)
     
 
 # CODES ------------------------------------------------
 
+    async def get_giftcodes(self, guild: discord.Guild) -> dict:
+        """Renvoie le registre des codes cadeaux du serveur, chargé lors du premier appel
+        
+        Chaque code est associé à sa valeur, son nombre d'utilisations (et leur maximum), son expiration et les membres l'ayant utilisé"""
+        if guild.id not in self.giftcodes:
+            raw = await self.config.guild(guild).Giftcodes()
+            codes = {}
+            for code, data in raw.items():
+                if not isinstance(data, dict): # Anciens codes : {code: valeur}
+                    data = {'value': data}
+                codes[code] = {'value': data['value'],
+                               'uses': data.get('uses', 0),
+                               'max_uses': data.get('max_uses', 1),
+                               'expire': data.get('expire'),
+                               'users': data.get('users', [])}
+            self.giftcodes.setdefault(guild.id, codes)
+            self.prune_giftcodes(guild.id)
+        return self.giftcodes[guild.id]
+    
+    def prune_giftcodes(self, guild_id: int):
+        """Retire du registre les codes expirés ou épuisés"""
+        codes = self.giftcodes.get(guild_id, {})
+        for code in [c for c in codes if not self._giftcode_valid(codes[c])]:
+            del codes[code]
+            self.dirty_giftcodes.add(guild_id)
+            
+    def _giftcode_valid(self, data: dict) -> bool:
+        return (data['expire'] is None or data['expire'] > time.time()) and data['uses'] < data['max_uses']
+    
+    async def flush_giftcodes(self):
+        """Enregistre les registres de codes cadeaux modifiés depuis le dernier enregistrement"""
+        for guild_id in list(self.dirty_giftcodes):
+            self.dirty_giftcodes.discard(guild_id)
+            if guild_id in self.giftcodes:
+                try:
+                    await self.config.guild_from_id(guild_id).Giftcodes.set(self.giftcodes[guild_id])
+                except BaseException:
+                    # Un code utilisé ne doit pas redevenir utilisable : le registre reste à enregistrer
+                    self.dirty_giftcodes.add(guild_id)
+                    raise
+
     async def get_giftcode(self, guild: discord.Guild, code: str) -> int:
-        codes = await self.config.guild(guild).Giftcodes()
-        if code in codes:
-            return codes[code]
+        codes = await self.get_giftcodes(guild)
+        if code in codes and self._giftcode_valid(codes[code]):
+            return codes[code]['value']
         return None
     
-    async def create_giftcode(self, guild: discord.Guild, code: str, value: int) -> str:
-        codes = await self.config.guild(guild).Giftcodes()
+    async def create_giftcode(self, guild: discord.Guild, code: str, value: int, max_uses: int = 1, expire: float = None) -> str:
+        codes = await self.get_giftcodes(guild)
         if code in codes:
             raise KeyError(f"'{code}' existe déjà dans les codes cadeaux sur {guild.name}")
+        if max_uses < 1:
+            raise ValueError("Un code doit pouvoir être utilisé au moins une fois")
         
-        await self.config.guild(guild).Giftcodes.set_raw(code, value=value)
+        codes[code] = {'value': value, 'uses': 0, 'max_uses': max_uses, 'expire': expire, 'users': []}
+        self.dirty_giftcodes.add(guild.id)
         return code
     
     async def delete_giftcode(self, guild: discord.Guild, code: str):
-        codes = await self.config.guild(guild).Giftcodes()
+        codes = await self.get_giftcodes(guild)
         if code not in codes:
             raise KeyError(f"'{code}' n'existe pas dans les codes cadeaux sur {guild.name}")
         
-        await self.config.guild(guild).Giftcodes.clear_raw(code)
+        del codes[code]
+        self.dirty_giftcodes.add(guild.id)
+        
+    async def claim_giftcode(self, member: discord.Member, code: str) -> Transaction:
+        """Utilise le code cadeau pour le membre et crédite son compte
+        
+        La vérification et le décompte de l'utilisation se font sous le verrou du code, un même code ne peut donc pas être utilisé au-delà de son quota"""
+        guild = member.guild
+        codes = await self.get_giftcodes(guild)
+        async with self.giftcode_locks.setdefault((guild.id, code), asyncio.Lock()):
+            if code not in codes or not self._giftcode_valid(codes[code]):
+                raise KeyError(f"'{code}' n'est pas un code cadeau valide sur {guild.name}")
+            data = codes[code]
+            if member.id in data['users']:
+                raise ValueError(f"{member} a déjà utilisé le code '{code}'")
+            
+            data['uses'] += 1
+            data['users'].append(member.id)
+            if data['uses'] >= data['max_uses']:
+                del codes[code]
+                self.giftcode_locks.pop((guild.id, code), None)
+            self.dirty_giftcodes.add(guild.id)
+        return await self.deposit_credits(member, data['value'], desc="Code cadeau récupéré")
 
 
+# EXPORT -----------------------------------------------
+
+    async def export_records(self, guild: discord.Guild):
+        """Générateur asynchrone des données bancaires du serveur (paramètres, comptes puis transactions de chaque compte)
+        
+        Les transactions sont lues membre par membre pour ne pas charger tout l'historique du serveur en mémoire"""
+        await self.flush_balances()
+        await self.flush_giftcodes()
+        yield {'type': 'guild', 'data': await self.config.guild(guild).all()}
+        users = await self.config.all_members(guild)
+        async for uid, data in AsyncIter(users.items(), steps=100):
+            yield {'type': 'account', 'member': uid, 'data': {'Balance': data['Balance'], 'Config': data['Config']}}
+            segments = await self.config.custom('Transactions', str(guild.id), str(uid)).all()
+            for seg in sorted(segments, key=int):
+                for log in segments[seg].get('Entries', []):
+                    yield {'type': 'transaction', 'member': uid, 'data': log}
+                    
+    async def export_guild(self, guild: discord.Guild) -> tuple:
+        """Exporte les données bancaires du serveur dans un fichier NDJSON (un enregistrement par ligne)
+        
+        Renvoie le chemin du fichier et le nombre d'enregistrements écrits. Le fichier contenant toutes les données bancaires du serveur,
+        c'est à l'appelant de le supprimer une fois envoyé (il est supprimé ici si l'export échoue)"""
+        path = cog_data_path(self) / f'export_{guild.id}_{int(time.time())}.ndjson'
+        n = 0
+        try:
+            with path.open('w', encoding='utf-8') as f:
+                async for record in self.export_records(guild):
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    n += 1
+        except BaseException:
+            path.unlink(missing_ok=True)
+            raise
+        return path, n
+    
+    async def import_guild(self, guild: discord.Guild, path) -> dict:
+        """Importe les données bancaires d'un fichier NDJSON produit par *export_guild*
+        
+        Les comptes sont écrasés et les transactions ajoutées à l'historique existant, par lots de TRANSFER_CHUNK_SIZE enregistrements.
+        Le verrou du serveur est détenu pendant toute l'importation. Renvoie le nombre d'enregistrements importés par type"""
+        await self.flush_balances()
+        await self.flush_giftcodes()
+        counts = {'guild': 0, 'account': 0, 'transaction': 0}
+        accounts, logs = {}, {}
+        pending = 0
+        async with self.get_guild_lock(guild.id):
+            with path.open(encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    if record['type'] == 'guild':
+                        await self.config.guild(guild).set(record['data'])
+                        # Le registre des codes cadeaux importé remplace celui en mémoire
+                        self.giftcodes.pop(guild.id, None)
+                        self.dirty_giftcodes.discard(guild.id)
+                    elif record['type'] == 'account':
+                        accounts[record['member']] = record['data']
+                    elif record['type'] == 'transaction':
+                        seg = str(self.log_segment(record['data']['timestamp']))
+                        logs.setdefault(str(record['member']), {}).setdefault(seg, []).append(record['data'])
+                    else:
+                        raise ValueError(f"Type d'enregistrement inconnu : {record['type']}")
+                    counts[record['type']] += 1
+                    pending += 1
+                    
+                    if pending >= TRANSFER_CHUNK_SIZE:
+                        await self._import_chunk(guild, accounts, logs)
+                        accounts, logs = {}, {}
+                        pending = 0
+            await self._import_chunk(guild, accounts, logs)
+            self.reset_guild_cache(guild.id)
+        return counts
+    
+    async def _import_chunk(self, guild: discord.Guild, accounts: dict, logs: dict):
+        if accounts:
+            await commit_members(self.config, guild.id, accounts)
+            self.drop_imported_balances(guild.id, accounts)
+        if logs:
+            async with self.config.custom('Transactions', str(guild.id)).all() as tree:
+                for uid, segments in logs.items():
+                    for seg, entries in segments.items():
+                        current = tree.setdefault(uid, {}).setdefault(seg, {}).setdefault('Entries', [])
+                        known = {(l['timestamp'], l['delta'], l.get('seq')) for l in current}
+                        current.extend([l for l in entries if (l['timestamp'], l['delta'], l.get('seq')) not in known])
+                        current.sort(key=lambda l: l['timestamp'])
+                        self.track_segment(guild.id, int(uid), int(seg))
+    
+
 # CONFIG -----------------------------------------------
 
     async def wipe_member_logs(self, member: discord.Member) -> None:
         """Supprime tous les logs d'un membre"""
-        await self.config.member(member).clear_raw('Logs')
+        await self.config.custom('Transactions', str(member.guild.id), str(member.id)).clear()
+        self.forget_logs(member.guild.id, member.id)
 
     async def wipe_guild(self, guild: discord.Guild) -> None:
         """Supprime les données bancaires des membres d'un serveur"""
-        await self.config.clear_all_members(guild)
+        async with self.get_guild_lock(guild.id):
+            self.drop_cached_balances(guild.id)
+            await self.config.clear_all_members(guild)
+            await self.config.custom('Transactions', str(guild.id)).clear()
+            self.forget_segments(guild.id)
+            self.reset_guild_cache(guild.id)
 
     async def wipe_account(self, member: discord.Member) -> None:
         """Supprime les données bancaires d'un membre"""
+        self.drop_cached_balances(member.guild.id, member.id)
         await self.config.member(member).clear()
+        await self.wipe_member_logs(member)
+        self.track_balance(member.guild.id, member.id, 0)
 
     async def delete_account_id(self, user_id: int, guild: discord.Guild) -> None:
         """Supprime un compte bancaire par ID du membre"""
+        self.drop_cached_balances(guild.id, user_id)
         await self.config.member_from_ids(guild.id, user_id).clear()
+        await self.config.custom('Transactions', str(guild.id), str(user_id)).clear()
+        self.forget_logs(guild.id, user_id)
+        self.track_balance(guild.id, user_id)
 
     async def red_delete_data_for_user(
         self, *, requester: Literal["discord", "owner", "user", "user_strict"], user_id: int
@@ -336,9 +1268,29 @@ class XPay(commands.Cog):
         all_members = await self.config.all_members()
         async for guild_id, guild_data in AsyncIter(all_members.items(), steps=100):
             if user_id in guild_data:
+                self.drop_cached_balances(guild_id, user_id)
                 await self.config.member_from_ids(guild_id, user_id).clear()
+                self.track_balance(guild_id, user_id)
+        await self.load_log_segments()
+        guild_ids = {g for members in self.log_segments.values() for g, u in members if u == user_id}
+        for guild_id in guild_ids:
+            await self.config.custom('Transactions', str(guild_id), str(user_id)).clear()
+            self.forget_logs(guild_id, user_id)
           
                 
+# EVENTS ------------------------------------------------
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        if member.guild.id in self.leaderboards:
+            self.leaderboards[member.guild.id].update(member.id, await self.get_balance(member))
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        if member.guild.id in self.leaderboards:
+            self.leaderboards[member.guild.id].remove(member.id)
+            
+                
 # UTILS -------------------------------------------------
 
     async def utils_parse_timedelta(self, time_string: str) -> timedelta:
@@ -385,9 +1337,9 @@ class XPay(commands.Cog):
         medal = f' {MEDALS[rank]}' if rank in MEDALS else ''
         em.add_field(name="Rang", value=box(f"#{rank}{medal}", lang='css'))
         
-        logs = await self.member_logs(user)
+        logs = [Transaction(user, l) for l in (await self.member_raw_logs(user))[-5:]]
         if logs:
-            txt = "\n".join([f"{log.delta:+}{'ʳ' if log.refund else ''} · {log.description[:50]}" for log in logs][::-1][:5])
+            txt = "\n".join([f"{log.delta:+}{'ʳ' if log.refund else ''} · {log.description[:50]}" for log in logs][::-1])
             em.add_field(name=f"Historique", value=box(txt), inline=False)
             
         em.set_footer(text=f"Compte bancaire – {guild.name}")
@@ -405,9 +1357,12 @@ class XPay(commands.Cog):
         em.set_thumbnail(url=guild.icon_url)
         em.set_footer(text=f"¹Réinitialisation tous les lundis\n²Prélevée sur la somme transférée si les fonds sont insuffisants")
         
-        stats = f"**Crédits en circulation** · {humanize_number(await self.guild_total_credits(guild))}{currency}\n"
-        stats += f"**Solde moyen** (>0{currency}) · {round(await self.guild_average_balance(guild), 2)}{currency}\n"
-        stats += f"**Écart type du solde** (>0{currency}) · {round(await self.guild_balance_standard_deviation(guild), 2)}\n"
+        gstats = await self.guild_stats(guild)
+        stats = f"**Crédits en circulation** · {humanize_number(gstats['total'])}{currency}\n"
+        stats += f"**Solde moyen** (>0{currency}) · {round(gstats['mean'], 2)}{currency}\n"
+        stats += f"**Solde médian** (>0{currency}) · {round(gstats['median'], 2)}{currency}\n"
+        stats += f"**Écart type du solde** (>0{currency}) · {round(gstats['stdev'], 2)}\n"
+        stats += f"**Coefficient de Gini** (>0{currency}) · {round(gstats['gini'], 3)}\n"
         em.add_field(name="Statistiques", value=stats)
         
         income = data['Income']
@@ -416,7 +1371,8 @@ class XPay(commands.Cog):
             incometxt += f"› Solde maximal pour son attribution · {income['BaseLimit']}{currency}\n"
         incometxt += f"**Booster du serveur** · {income['Booster']}{currency}\n"
         incometxt += f"**Solde faible** · {income['LowBalance']}{currency}\n"
-        incometxt += f"› Solde considéré comme faible · Inf. à {income['LowBalanceLimit']}{currency}"
+        incometxt += f"› Solde considéré comme faible · Inf. à {income['LowBalanceLimit']}{currency}\n"
+        incometxt += f"**Versement automatique** · {'Activé' if income.get('Auto') else 'Désactivé'}"
         em.add_field(name="Aides journalières", value=incometxt)
         
         setts = data['Settings']
@@ -434,34 +1390,65 @@ class XPay(commands.Cog):
         Mentionner un autre membre avec la commande permet de consulter son historique"""
         user = user if user else ctx.message.author
         
-        logs = await self.member_logs(user)
-        if not logs:
+        raws = await self.member_raw_logs(user)
+        if not raws:
             return await ctx.reply(f"**Aucune opération dans l'historique** • Il n'y a aucune opération enregistrée sur ce compte",
                                    mention_author=False)
         
-        embeds = []
+        pages = [self.history_page(user, raws, page) for page in range((len(raws) - 1) // 25 + 1)]
+        if len(pages) == 1:
+            return await ctx.reply(embed=pages[0], mention_author=False)
+        await menu(ctx, pages, DEFAULT_CONTROLS)
+            
+    def history_page(self, user: discord.Member, raws: List[dict], page: int) -> discord.Embed:
+        """Génère la page *page* de l'historique (25 opérations, des plus récentes aux plus anciennes) en ne décodant que les transactions affichées"""
+        end = len(raws) - page * 25
+        today = datetime.now().strftime('%d/%m/%Y')
         tabl = []
-        for log in logs[::-1]:
-            if len(tabl) < 25:
-                fmt = '%d/%m/%Y %H:%M' if log.ftimestamp('%d/%m/%Y') != datetime.now().strftime('%d/%m/%Y') else '%H:%M'
-                tabl.append((log.ftimestamp(fmt), f"{log.delta:+}{'ʳ' if log.refund else ''}", f"{log.description[:50]}"))
-            else:
-                em = discord.Embed(color=user.color, description=box(tabulate(tabl, headers=["Date/Heure", "Opération", "Description"])))
-                em.set_author(name=f'{user.name}', icon_url=user.avatar_url)
-                em.set_footer(text=f"Historique – {ctx.guild.name}")
-                embeds.append(em)
-                tabl = []
-        if tabl:
-            em = discord.Embed(color=user.color, description=box(tabulate(tabl, headers=["Date/Heure", "Opération", "Description"])))
-            em.set_author(name=f'{user.name}', icon_url=user.avatar_url)
-            em.set_footer(text=f"Historique – {ctx.guild.name}")
-            embeds.append(em)
+        for raw in raws[max(0, end - 25):end][::-1]:
+            log = Transaction(user, raw)
+            fmt = '%d/%m/%Y %H:%M' if log.ftimestamp('%d/%m/%Y') != today else '%H:%M'
+            tabl.append((log.ftimestamp(fmt), f"{log.delta:+}{'ʳ' if log.refund else ''}", f"{log.description[:50]}"))
+        em = discord.Embed(color=user.color, description=box(tabulate(tabl, headers=["Date/Heure", "Opération", "Description"])))
+        em.set_author(name=f'{user.name}', icon_url=user.avatar_url)
+        em.set_footer(text=f"Historique – {user.guild.name} · Page {page + 1}/{(len(raws) - 1) // 25 + 1}")
+        return em
+            
+    @commands.command(name="curve")
+    @commands.guild_only()
+    async def balance_curve(self, ctx, user: Optional[discord.Member] = None, *, period: str = '7j'):
+        """Afficher l'évolution du solde sur une période (par défaut 7 jours)
         
-        if embeds:
-            await menu(ctx, embeds, DEFAULT_CONTROLS)
-        else:
-            return await ctx.reply(f"**Aucune opération dans l'historique** • Il n'y a aucune opération enregistrée sur ce compte",
-                                   mention_author=False)
+        La période s'exprime au format `Xj Xh Xm` et ne peut dépasser la durée de conservation des transactions"""
+        user = user if user else ctx.author
+        try:
+            seconds = min(int((await self.utils_parse_timedelta(period)).total_seconds()), LOGS_EXPIRATION)
+        except ValueError:
+            return await ctx.reply("**Erreur** • La période est invalide, utilisez le format `Xj Xh Xm`", mention_author=False)
+        if seconds <= 0:
+            return await ctx.reply("**Erreur** • La période doit être positive", mention_author=False)
+        
+        history = await self.get_balance_history(user)
+        balance = await self.get_balance(user)
+        currency = await self.get_currency(ctx.guild)
+        
+        now = time.time()
+        points = 24
+        values = [balance - (history.total - history.prefix(now - seconds + seconds * i / (points - 1))) for i in range(points)]
+        low, high = min(values), max(values)
+        bars = '▁▂▃▄▅▆▇█'
+        curve = ''.join([bars[int((v - low) / (high - low) * (len(bars) - 1))] if high != low else bars[0] for v in values])
+        
+        var = values[-1] - values[0]
+        em = discord.Embed(color=user.color)
+        em.set_author(name=f'{user.name}' if user != ctx.author else "Votre compte", icon_url=user.avatar_url)
+        em.description = box(f"{curve}\n{humanize_timedelta(seconds=seconds)} → maintenant")
+        em.add_field(name="Début", value=box(f"{values[0]}{currency}"))
+        em.add_field(name="Fin", value=box(f"{values[-1]}{currency}"))
+        em.add_field(name="Variation", value=box(f"{var:+}", lang='fix' if var < 0 else 'css'))
+        em.add_field(name="Min. / Max.", value=box(f"{low} / {high}{currency}"))
+        em.set_footer(text=f"Évolution du solde – {ctx.guild.name}")
+        await ctx.reply(embed=em, mention_author=False)
             
     @commands.command(name="give")
     @commands.guild_only()
@@ -495,12 +1482,11 @@ class XPay(commands.Cog):
                 sum -= fee
                 
         try:
-            await self.withdraw_credits(author, fee + sum, desc=f'Don à {member.name}')
-        except:
+            await self.apply_deltas(guild, [(author, -(fee + sum), {'desc': f'Don à {member.name}'}),
+                                            (member, sum, {'desc': reasonstring})])
+        except ValueError:
             return await ctx.reply(f"{stop} **Fonds insuffisants** • Vous n'avez pas cette somme sur votre compte")
         else:
-            await self.deposit_credits(member, sum, desc=reasonstring)
-            
             txt = f"{conf} **Don effectué** • {member.mention} a reçu {humanize_number(sum)}{currency} de votre part"
             if fee:
                 txt += f" [Frais · -{fee}{currency}]"
@@ -521,36 +1507,29 @@ class XPay(commands.Cog):
         author = ctx.author
         guild = ctx.guild
         today = datetime.now().strftime("%Y%m%d")
-        account = await self.get_account(author)
         currency = await self.get_currency(ctx.guild)
         
         income = await self.config.guild(guild).Income()
-        total = 0
-        text = ''
 
-        if account.config['day'] == today:
+        # Le versement automatique écrit les comptes du serveur sous le même verrou, le jour enregistré fait foi
+        async with self.get_guild_lock(guild.id):
+            account = await self.get_account(author)
+            claimed = account.config['day'] == today
+            if not claimed:
+                details = self.daily_income_details(income, account.balance, bool(author.premium_since))
+                total = sum([amount for amount, _ in details])
+                text = ''.join([f"+ {amount} · {label}\n" for amount, label in details])
+                if text:
+                    await self.config.member(author).Config.set_raw('day', value=today)
+                    await self.deposit_credits(author, total, desc='Aides journalières')
+        
+        if claimed:
             em = discord.Embed(description="**Vous n'avez plus aucune aide à récupérer pour aujourd'hui**\nRevenez demain !", color=author.color)
             em.set_author(name="Vos aides journalières", icon_url=author.avatar_url)
             return await ctx.reply(embed=em, mention_author=False)
         
-        if income['BaseLimit'] and account.balance > income['BaseLimit']:
-            text += f"+ 0 · Base d'aide journalière (Solde trop élevé)\n"
-        else:
-            total += income['Base']
-            text += f"+ {income['Base']} · Base d'aide journalière\n"
-        
-        if ctx.author.premium_since:
-            total += income['Booster']
-            text += f"+ {income['Booster']} · Booster du serveur\n"
-        
-        if account.balance < income['LowBalanceLimit']:
-            total += income['LowBalance']
-            text += f"+ {income['LowBalance']} · Majoration solde faible\n"
-        
         if text:
             text += f'————————————\n= {total}{currency}'
-            await self.config.member(author).Config.set_raw('day', value=today)
-            await self.deposit_credits(author, total, desc='Aides journalières')
             em = discord.Embed(description=box(text), color=author.color)
             em.set_author(name="Vos aides journalières", icon_url=author.avatar_url)
             em.set_footer(text=f"Nouveau solde · {await self.get_balance(author)}{currency}")
@@ -627,9 +1606,14 @@ class XPay(commands.Cog):
             emoji = react.emoji
             
         if emoji == conf:
-            await self.delete_giftcode(guild, code)
-            await self.deposit_credits(author, value, desc="Code cadeau récupéré")
-            em.set_footer(text=f"{value}{currency} ont été transférés sur votre compte")
+            try:
+                await self.claim_giftcode(author, code)
+            except KeyError:
+                em.set_footer(text=f"Ce code a expiré ou a déjà été utilisé entre temps")
+            except ValueError:
+                em.set_footer(text=f"Vous avez déjà utilisé ce code")
+            else:
+                em.set_footer(text=f"{value}{currency} ont été transférés sur votre compte")
             await msg.edit(embed=em)
             await msg.delete(delay=10)
         
@@ -640,18 +1624,35 @@ class XPay(commands.Cog):
                 
     @commands.command(name='giftcode')
     @checks.admin_or_permissions(manage_messages=True)
-    async def create_code(self, ctx, value: int, codename: str = None):
+    async def create_code(self, ctx, value: int, codename: str = None, uses: int = 1, *, duration: str = None):
         """Créer un code de récompense de crédits
         
-        Si aucun nom pour le code n'est donné, génère un code aléatoire de 8 caractères"""
+        Si aucun nom pour le code n'est donné (ou `*`), génère un code aléatoire de 8 caractères
+        `uses` correspond au nombre de membres différents pouvant utiliser le code
+        `duration` est la durée de validité du code au format `Xj Xh Xm` (illimitée par défaut)"""
         guild = ctx.guild
         currency = await self.get_currency(ctx.guild)
-        codename = codename if codename else ''.join(random.sample(string.ascii_letters + string.digits, k=8))
-        if await self.get_giftcode(guild, codename):
-            return await ctx.send("**Code préexistant** • Un code actif identique existe déjà")
+        codename = codename if codename and codename != '*' else ''.join(random.sample(string.ascii_letters + string.digits, k=8))
+        expire = None
+        if duration:
+            try:
+                expire = time.time() + (await self.utils_parse_timedelta(duration)).total_seconds()
+            except ValueError:
+                return await ctx.send("**Durée invalide** • Utilisez le format `Xj Xh Xm`")
         
-        code = await self.create_giftcode(ctx.guild, codename, value)
-        em = discord.Embed(description=f"**Code :** ||{code}||\n__Contient :__ {value:+}{currency}")
+        try:
+            code = await self.create_giftcode(ctx.guild, codename, value, max_uses=uses, expire=expire)
+        except KeyError:
+            return await ctx.send("**Code préexistant** • Un code actif identique existe déjà")
+        except ValueError as e:
+            return await ctx.send(f"**Erreur** • {e}")
+        
+        desc = f"**Code :** ||{code}||\n__Contient :__ {value:+}{currency}"
+        if uses > 1:
+            desc += f"\n__Utilisations :__ {uses}"
+        if expire:
+            desc += f"\n__Expire le :__ {datetime.now().fromtimestamp(expire).strftime('%d/%m/%Y %H:%M')}"
+        em = discord.Embed(description=desc)
         em.set_footer(text=f"Un membre peut en récupérer le contenu avec ;redeem · {ctx.guild.name}")
         try:
             await ctx.author.send(embed=em)
@@ -709,14 +1710,16 @@ class XPay(commands.Cog):
             await ctx.reply(f"**Solde modifié** • Le nouveau solde de {member.mention} est {value}{currency}", mention_author=False)
     
     @edit_bank_account.command(name="search")
-    async def transaction_search(self, ctx, member: discord.Member, *search):
-        """Chercher une transaction en particulier pour obtenir son ID"""
-        logs = await self.member_logs(member)
-        if not logs:
-            return await ctx.reply(f"**Aucune opération dans l'historique** • Il n'y a aucune opération enregistrée sur ce compte",
+    async def transaction_search(self, ctx, member: Optional[discord.Member], *search):
+        """Chercher une transaction en particulier pour obtenir son ID
+        
+        Sans membre mentionné, la recherche porte sur les transactions de tous les membres du serveur"""
+        index = await self.get_search_index(ctx.guild)
+        if not index:
+            return await ctx.reply(f"**Aucune opération dans l'historique** • Il n'y a aucune opération enregistrée sur ce serveur",
                                    mention_author=False)
             
-        value = 0
+        value = None
         text = []
         for e in search:
             try:
@@ -724,21 +1727,30 @@ class XPay(commands.Cog):
             except:
                 text.append(e.lower())
         
-        if not (value or text):
+        if not (value is not None or text):
             return await ctx.reply("**Erreur** • Vous devez rentrer du texte ou une valeur pour rechercher une transaction", mention_author=False)
         
-        tabl = []
-        for log in [l for l in logs[::-1][:20] if l.description]:
-            if log.delta == value or len([e for e in text if e in log.description.lower()]) > 0:
-                tabl.append((log.id, log.ftimestamp('%d/%m/%Y %H:%M'), log.delta))
-            
-        if tabl:
-            em = discord.Embed(color=member.color, description=box(tabulate(tabl, headers=["ID", "Date/Heure", "Opération"])))
-            em.set_author(name=f'{member.name}', icon_url=member.avatar_url)
-            em.set_footer(text=f"Recherche d'ID – {ctx.guild.name}")
-            await ctx.reply(embed=em, mention_author=False)
-        else:
-            await ctx.reply("**Aucun résultat** • Essayez de rentrer la description de l'opération et la valeur", mention_author=False)
+        results = index.search(text, value, member.id if member else None)
+        if not results:
+            return await ctx.reply("**Aucun résultat** • Essayez de rentrer la description de l'opération et la valeur", mention_author=False)
+        
+        embeds = []
+        for p in range(0, len(results), 15):
+            tabl = []
+            for uid, raw in results[p:p + 15]:
+                log = Transaction(ctx.guild.get_member(uid), raw)
+                row = (log.id, log.ftimestamp('%d/%m/%Y %H:%M'), log.delta, log.description[:30])
+                tabl.append(row if member else (str(log.member) if log.member else uid,) + row)
+            headers = ["ID", "Date/Heure", "Opération", "Description"]
+            em = discord.Embed(color=member.color if member else await ctx.embed_color(), 
+                               description=box(tabulate(tabl, headers=headers if member else ["Membre"] + headers)))
+            if member:
+                em.set_author(name=f'{member.name}', icon_url=member.avatar_url)
+            else:
+                em.set_author(name=f'{ctx.guild.name}', icon_url=ctx.guild.icon_url)
+            em.set_footer(text=f"Recherche d'ID – {len(results)} résultat(s) · Page {p // 15 + 1}/{(len(results) - 1) // 15 + 1}")
+            embeds.append(em)
+        await menu(ctx, embeds, DEFAULT_CONTROLS)
     
     @edit_bank_account.command(name="rollback")
     async def rollback_transaction(self, ctx, member: discord.Member, transaction_id: str):
@@ -894,11 +1906,90 @@ class XPay(commands.Cog):
                 "**Impossible** • Le nombre doit être positif, ou nul si vous voulez désactiver la fonctionnalité")
         
         
+    @bank_settings.command(name='autoincome')
+    @checks.admin_or_permissions(manage_messages=True)
+    async def set_income_auto(self, ctx, value: bool):
+        """Activer/désactiver le versement automatique des aides journalières
+        
+        Lorsqu'il est activé, les aides sont versées une fois par jour à tous les membres possédant un compte"""
+        guild = ctx.guild
+        await self.config.guild(guild).Income.set_raw('Auto', value=value)
+        if value:
+            await ctx.send("**Fonctionnalité activée** • Les aides journalières seront versées automatiquement chaque jour")
+        else:
+            self.income_days.pop(guild.id, None)
+            await ctx.send("**Fonctionnalité désactivée** • Les membres devront récupérer leurs aides avec `;bonus`")
+        
+    @bank_settings.command(name="migrate")
+    @checks.is_owner()
+    async def _bank_migrate(self, ctx, apply: bool = False):
+        """Importer les soldes et paramètres de l'ancien module AltEco sur tous les serveurs
+        
+        Sans préciser `apply`, affiche seulement les modifications qu'entraînerait l'importation"""
+        msg = await ctx.send("**Importation** • Lecture des données AltEco...")
+        
+        async def progress(guild: discord.Guild, done: int, total: int):
+            await msg.edit(content=f"**Importation** • {guild.name} · {done}/{total} comptes écrits")
+        
+        try:
+            report = await self.migrate_from_alteco(dry_run=not apply, progress=progress)
+        except Exception as e:
+            return await msg.edit(content=f"**Erreur** • L'importation a échoué : `{e}`")
+        
+        tabl = []
+        for guild_id, r in report.items():
+            if r['accounts']:
+                guild = self.bot.get_guild(guild_id)
+                tabl.append((guild.name[:20] if guild else guild_id, r['accounts'], r['changed'], f"{r['delta']:+}"))
+        if not tabl:
+            return await msg.edit(content="**Aucune donnée** • Aucun compte AltEco n'a été trouvé sur les serveurs du bot")
+        
+        title = "**Importation terminée**" if apply else "**Simulation** • Aucune donnée n'a été modifiée, utilisez `bankset migrate true` pour appliquer"
+        await msg.edit(content=title + "\n" + box(tabulate(tabl, headers=["Serveur", "Comptes", "Modifiés", "Δ Crédits"])))
+        
+    @bank_settings.command(name="export")
+    @checks.admin_or_permissions(administrator=True)
+    async def _bank_export(self, ctx):
+        """Exporter les données bancaires du serveur (paramètres, comptes et transactions) au format NDJSON"""
+        async with ctx.typing():
+            path, n = await self.export_guild(ctx.guild)
+        keep = False
+        try:
+            await ctx.reply(f"**Export terminé** • {n} enregistrements exportés", file=discord.File(str(path)), mention_author=False)
+        except HTTPException:
+            keep = True
+            await ctx.reply(f"**Export terminé** • {n} enregistrements exportés\n"
+                            f"Le fichier est trop lourd pour être envoyé, il a été conservé sur le serveur du bot : `{path}`\n"
+                            f"Il contient toutes les données bancaires du serveur, pensez à le supprimer après l'avoir récupéré", mention_author=False)
+        finally:
+            if not keep:
+                path.unlink(missing_ok=True)
+            
+    @bank_settings.command(name="import")
+    @checks.admin_or_permissions(administrator=True)
+    async def _bank_import(self, ctx):
+        """Importer des données bancaires depuis un fichier NDJSON obtenu avec `bankset export`
+        
+        Le fichier doit être joint au message de la commande. Les comptes présents dans le fichier sont écrasés"""
+        if not ctx.message.attachments:
+            return await ctx.reply("**Erreur** • Joignez à la commande le fichier obtenu avec `bankset export`", mention_author=False)
+        
+        path = cog_data_path(self) / f'import_{ctx.guild.id}_{int(time.time())}.ndjson'
+        async with ctx.typing():
+            await ctx.message.attachments[0].save(path)
+            try:
+                counts = await self.import_guild(ctx.guild, path)
+            except (ValueError, KeyError) as e:
+                return await ctx.reply(f"**Erreur** • Le fichier est invalide : `{e}`", mention_author=False)
+            finally:
+                path.unlink()
+        await ctx.reply(f"**Import terminé** • {counts['account']} comptes et {counts['transaction']} transactions importés", mention_author=False)
+        
     @bank_settings.command(name="resetuser")
     @checks.admin_or_permissions(manage_messages=True)
     async def _bank_reset_account(self, ctx, user: discord.Member):
         """Reset les données bancaires d'un membre (cache compris)"""
-        await self.config.member(user).clear()
+        await self.wipe_account(user)
         await ctx.send(f"**Succès** • Le compte de {user.mention} a été réinitialisé")
         
     @bank_settings.command(name="resetday")